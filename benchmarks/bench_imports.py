@@ -0,0 +1,69 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Entry points of the CLI and the export workers, plus the stages they load on demand.
+# app.py is a Streamlit script: pass it explicitly to include the cost of streamlit itself.
+DEFAULT_MODULES = ['jobs', 'cli', 'epub_builder', 'scraper', 'http_client']
+# Heavy dependencies that should only be loaded when their stage first runs
+HEAVY_MODULES = ['requests', 'bs4', 'soupsieve', 'lxml', 'selectolax', 'PIL', 'cProfile', 'http.server']
+
+def measure(module):
+    """
+    Imports `module` in a fresh interpreter with -X importtime and returns
+    (import seconds, {direct import: cumulative seconds}).
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=ROOT,
+                            capture_output=True, text=True)
+    total, children, pending = 0.0, {}, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            # Imports are listed before the one that triggered them
+            pending[name.strip()] = int(cumulative) / 1e6
+        elif depth == 0:
+            # Interpreter startup (site, encodings) is not part of the module's cost
+            if name.strip() == module:
+                total, children = int(cumulative) / 1e6, pending
+            pending = {}
+    return total, children
+
+def best_of(module, repeat):
+    # Minimum over several runs is the least noisy estimate
+    runs = [measure(module) for _ in range(repeat)]
+    return min(runs, key=lambda run: run[0])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cold import time of the entry points, each in a fresh interpreter.")
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES, help="Modules to import (default: the entry points)")
+    parser.add_argument('-n', '--repeat', type=int, default=5, help="Runs per module (best is kept)")
+    parser.add_argument('--top', type=int, default=5, help="Slowest top-level imports shown per module")
+    parser.add_argument('--json', metavar='PATH', help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for module in args.modules:
+        total, children = best_of(module, args.repeat)
+        # Which heavy dependencies were pulled in eagerly
+        check = subprocess.run([sys.executable, '-c', f'import sys, {module}; print(" ".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))'],
+                               cwd=ROOT, capture_output=True, text=True)
+        heavy = check.stdout.split()
+        results[module] = {'import_ms': round(total * 1000, 1), 'heavy_loaded': heavy,
+                           'slowest': {name: round(seconds * 1000, 1) for name, seconds in
+                                       sorted(children.items(), key=lambda item: -item[1])[:args.top]}}
+        slowest = ', '.join(f'{name} {ms}' for name, ms in results[module]['slowest'].items())
+        print(f"{module:<14} {results[module]['import_ms']:>8.1f} ms   heavy: {' '.join(heavy) or '-':<20} slowest (ms): {slowest}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
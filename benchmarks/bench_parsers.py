@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import parsers
+from scraper import clean_chapter_html
+
+def collect_pages(paths):
+    pages = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                pages.extend(os.path.join(root, f) for f in sorted(files) if f.endswith(('.html', '.htm')))
+        else:
+            pages.append(path)
+    return pages
+
+def best_of(func, repeat):
+    # Minimum over several runs is the least noisy estimate
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the HTML parser backends on saved chapter and index pages.")
+    parser.add_argument('paths', nargs='+', help="Saved .html pages or directories containing them")
+    parser.add_argument('-n', '--repeat', type=int, default=5, help="Runs per measurement (best is kept)")
+    args = parser.parse_args(argv)
+
+    pages = []
+    for path in collect_pages(args.paths):
+        with open(path, 'rb') as f:
+            pages.append(f.read())
+    if not pages:
+        parser.error("no .html pages found")
+    chapter_pages = [p for p in pages if b'chapter-content' in p]
+    index_pages = [p for p in pages if b'list-chapter' in p]
+    print(f"{len(pages)} pages ({len(chapter_pages)} chapter, {len(index_pages)} index), "
+          f"{sum(map(len, pages)) / 1024:.0f} KiB total, best of {args.repeat} runs")
+    print()
+    print(f"{'backend':<12} {'full parse':>12} {'scoped parse':>13} {'clean chapter':>14}   (ms per page)")
+
+    for backend in parsers.available_backends():
+        full = best_of(lambda: [parsers.make_soup(p, backend) for p in pages], args.repeat)
+        scoped = best_of(lambda: [parsers.parse_scoped(p, 'chapter-content', backend) for p in chapter_pages]
+                                 + [parsers.parse_scoped(p, 'list-chapter', backend) for p in index_pages], args.repeat)
+
+        parsers.set_backend(backend)
+        clean = best_of(lambda: [clean_chapter_html(p) for p in chapter_pages], args.repeat)
+
+        per_page = lambda seconds, count: f"{seconds * 1000 / count:.2f}" if count else "-"
+        print(f"{backend:<12} {per_page(full, len(pages)):>12} "
+              f"{per_page(scoped, len(chapter_pages) + len(index_pages)):>13} "
+              f"{per_page(clean, len(chapter_pages)):>14}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+import scraper
+import metrics
+import http_client
+import postprocess
+import sites
+from chapter_cache import ChapterCache
+from epub_builder import create_epub
+from mock_server import MockNovelSite
+
+DEFAULT_SIZES = [100, 1000, 10000]
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def run_single(size, args):
+    """
+    Runs the whole pipeline once against a local mock site and returns the measurements.
+    """
+    metrics.reset()
+    # The mock site has the novelfull layout
+    sites.register_adapter(sites.NovelFullAdapter(), ['127.0.0.1'])
+    # Let every worker have a request in flight
+    http_client.configure(max_per_host=args.workers)
+    postprocess.configure(processes=args.processes)
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            MockNovelSite(chapters=size, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                          images=args.images) as site:
+        start = time.perf_counter()
+        chapters_data, title, cover_url, author = scraper.get_chapters(
+            site.novel_url, max_workers=args.workers, requests_per_second=args.rate)
+        analyze_seconds = time.perf_counter() - start
+
+        cache = ChapterCache(os.path.join(tmp, 'chapters.sqlite3'), max_bytes=10 ** 12)
+        start = time.perf_counter()
+        create_epub(title, author, chapters_data, None, cover_url, max_workers=args.workers,
+                    requests_per_second=args.rate, cache=cache, output_path=os.path.join(tmp, 'download.epub'))
+        download_seconds = time.perf_counter() - start
+
+        # Second build is served entirely from the cache: this is the pure ePub build cost
+        start = time.perf_counter()
+        create_epub(title, author, chapters_data, None, cover_url, max_workers=args.workers,
+                    requests_per_second=args.rate, cache=cache, output_path=os.path.join(tmp, 'rebuild.epub'))
+        build_seconds = time.perf_counter() - start
+        epub_bytes = os.path.getsize(os.path.join(tmp, 'rebuild.epub'))
+        cache.close()
+
+        # Only the first build parses pages; the rebuild is served from the cache
+        timings = metrics.snapshot()['timings']
+        extraction = {stage: timings.get(f'stage_seconds{{stage="{stage}"}}')
+                      for stage in ('parse', 'locate', 'clean', 'serialize')}
+        pages = extraction['parse']['count'] if extraction['parse'] else 0
+        stage_ms = {stage: round(timing['sum'] * 1000 / pages, 3)
+                    for stage, timing in extraction.items() if timing} if pages else {}
+
+        return {
+            'chapters': size,
+            'processes': args.processes,
+            'chapters_found': len(chapters_data),
+            'analyze_s': round(analyze_seconds, 3),
+            'download_s': round(download_seconds, 3),
+            'chapters_per_s': round(len(chapters_data) / download_seconds, 1) if download_seconds else None,
+            'parse_ms_per_chapter': round(sum(stage_ms.values()), 3) if stage_ms else None,
+            'stage_ms_per_chapter': stage_ms,
+            'build_s': round(build_seconds, 3),
+            'epub_mb': round(epub_bytes / (1024 * 1024), 2),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'requests': site.stats['requests'],
+            'injected_errors': site.stats['errors'],
+        }
+
+def print_table(results):
+    columns = ['chapters', 'processes', 'analyze_s', 'download_s', 'chapters_per_s', 'parse_ms_per_chapter', 'build_s',
+               'epub_mb', 'peak_rss_mb', 'requests', 'injected_errors']
+    widths = [max(len(c), 8) for c in columns]
+    print('  '.join(c.rjust(w) for c, w in zip(columns, widths)))
+    for result in results:
+        print('  '.join(str(result.get(c, '-')).rjust(w) for c, w in zip(columns, widths)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Offline benchmark of analyze, download/parse and ePub build against a local mock site.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Novel sizes in chapters")
+    parser.add_argument('--workers', type=int, default=16, help="Parallel downloads")
+    parser.add_argument('--rate', type=float, default=1000.0, help="Max requests per second towards the mock site")
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of chapter requests failing with 429/503")
+    parser.add_argument('--images', type=int, default=0, help="Illustrations per chapter")
+    parser.add_argument('--processes', type=int, default=postprocess.DEFAULT_PROCESSES,
+                        help="Worker processes for parsing and boilerplate detection (1: in-process)")
+    parser.add_argument('--json', metavar='PATH', help="Also write the results to this JSON file")
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single:
+        print(json.dumps(run_single(args.single, args)))
+        return
+
+    # Every size runs in a fresh process so that peak RSS is measured per size
+    results = []
+    passthrough = ['--workers', str(args.workers), '--rate', str(args.rate), '--latency', str(args.latency),
+                   '--jitter', str(args.jitter), '--error-rate', str(args.error_rate), '--images', str(args.images),
+                   '--processes', str(args.processes)]
+    for size in args.sizes:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--single', str(size)] + passthrough,
+                                check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+        print(f"{size} chapters done", file=sys.stderr)
+    print_table(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+import os
+import re
+import time
+import zlib
+import struct
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+WORDS = ('the of and to a in he was that his it with as for had on at by not be this from but her '
+         'they she spirit mountain sect elder disciple heaven sword qi cultivation realm breakthrough '
+         'pill formation palace ancient clan lightning dao immortal mortal world voice eyes heart').split()
+
+# Distinct illustrations served under /img/
+IMAGE_POOL = 5
+
+def make_png(width, height, seed):
+    """
+    Encodes a colour gradient as a valid RGB PNG, so no imaging library is needed.
+    """
+    rng = random.Random(seed)
+    base = [rng.randrange(256) for _ in range(3)]
+    reds = bytes((base[0] + x) % 256 for x in range(width))
+    rows = []
+    for y in range(height):
+        row = bytearray(width * 3)
+        row[0::3] = reds
+        row[1::3] = bytes([(base[1] + y) % 256]) * width
+        row[2::3] = bytes([base[2]]) * width
+        rows.append(b'\x00' + bytes(row))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(b''.join(rows), 1)) + chunk(b'IEND', b''))
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+class MockNovelSite:
+    """
+    Local stand-in for a novelfull-style site, built from the recorded page
+    layouts in benchmarks/fixtures. Serves one novel with `chapters` chapters:
+
+        /<slug>.html?page=N            index pages (50 chapters per page)
+        /<slug>/chapter-N.html         chapter pages
+        /cover/<slug>.jpg              cover image
+
+        /img/N.png                     illustrations
+
+    `latency` (seconds, with +/- `jitter`) is added to every response, and a
+    fraction `error_rate` of chapter requests fail with 503 or 429. With `images`,
+    every chapter shows that many illustrations, drawn from a pool of a few
+    distinct pictures so that the same images come back across chapters.
+    """
+
+    def __init__(self, chapters=100, latency=0.0, jitter=0.0, error_rate=0.0, paragraphs=40, images=0,
+                 slug='mock-novel', per_page=50, host='127.0.0.1', port=0, seed=0):
+        self.chapters = chapters
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.paragraphs = paragraphs
+        self.images = images
+        self.image_cache = {}
+        self.slug = slug
+        self.per_page = per_page
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.index_template = load_fixture('index_page.html')
+        self.chapter_template = load_fixture('chapter_page.html')
+        self.stats = {'requests': 0, 'errors': 0, 'bytes': 0}
+        self.stats_lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def novel_url(self):
+        return f'{self.base_url}/{self.slug}.html'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def chapter_title(self, n):
+        return f'Chapter {n}: The Path Of The Immortal {n}'
+
+    def index_page(self, page):
+        last_page = max(1, (self.chapters + self.per_page - 1) // self.per_page)
+        first = (page - 1) * self.per_page + 1
+        items = '\n'.join(
+            f'          <li><a href="/{self.slug}/chapter-{n}.html" title="{self.chapter_title(n)}">'
+            f'<span class="chapter-text">{self.chapter_title(n)}</span></a></li>'
+            for n in range(first, min(self.chapters, page * self.per_page) + 1)
+        )
+        pagination = []
+        if page > 1:
+            pagination.append(f'      <li class="first"><a href="/{self.slug}.html?page=1">« First</a></li>')
+            pagination.append(f'      <li class="previous"><a href="/{self.slug}.html?page={page - 1}"><span class="glyphicon glyphicon-menu-left"></span></a></li>')
+        for p in range(max(1, page - 2), min(last_page, page + 2) + 1):
+            css = ' class="active"' if p == page else ''
+            pagination.append(f'      <li{css}><a href="/{self.slug}.html?page={p}">{p}</a></li>')
+        if page < last_page:
+            pagination.append(f'      <li class="next"><a href="/{self.slug}.html?page={page + 1}"><span class="glyphicon glyphicon-menu-right"></span></a></li>')
+            pagination.append(f'      <li class="last"><a href="/{self.slug}.html?page={last_page}">Last »</a></li>')
+        title = self.slug.replace('-', ' ').title()
+        return self.index_template.format(title=title, slug=self.slug, author='Er Gen', author_slug='Er+Gen',
+                                          chapter_items=items, pagination='\n'.join(pagination))
+
+    def chapter_page(self, n):
+        # Deterministic text per chapter, so repeated runs serve identical pages
+        rng = random.Random(n)
+        paragraphs = '\n'.join(
+            '        <p>' + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 80))).capitalize() + '.</p>'
+            for _ in range(self.paragraphs)
+        )
+        if self.images:
+            paragraphs += ''.join(f'\n        <p><img src="/img/{rng.randrange(IMAGE_POOL)}.png" alt="Illustration"></p>'
+                                  for _ in range(self.images))
+        return self.chapter_template.format(novel_title=self.slug.replace('-', ' ').title(), slug=self.slug,
+                                            chapter_title=self.chapter_title(n), number=n,
+                                            prev=max(1, n - 1), next=min(self.chapters, n + 1),
+                                            paragraphs=paragraphs)
+
+    def image(self, n):
+        with self.random_lock:
+            if n not in self.image_cache:
+                self.image_cache[n] = make_png(1600, 1200, n)
+            return self.image_cache[n]
+
+    def _handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def send_body(self, status, body, content_type='text/html; charset=utf-8', headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+                with site.stats_lock:
+                    site.stats['bytes'] += len(body)
+
+            def do_GET(self):
+                with site.random_lock:
+                    delay = max(0.0, site.latency + site.random.uniform(-site.jitter, site.jitter))
+                    error_status = site.random.choice([429, 503]) if site.random.random() < site.error_rate else None
+                with site.stats_lock:
+                    site.stats['requests'] += 1
+                if delay:
+                    time.sleep(delay)
+
+                url = urlparse(self.path)
+                chapter = re.fullmatch(rf'/{re.escape(site.slug)}/chapter-(\d+)\.html', url.path)
+                if url.path == f'/{site.slug}.html':
+                    page = int(parse_qs(url.query).get('page', ['1'])[0])
+                    self.send_body(200, site.index_page(page).encode('utf-8'))
+                elif chapter and 1 <= int(chapter.group(1)) <= site.chapters:
+                    if error_status:
+                        with site.stats_lock:
+                            site.stats['errors'] += 1
+                        self.send_body(error_status, b'<html><body>Slow down</body></html>', headers={'Retry-After': '1'})
+                        return
+                    self.send_body(200, site.chapter_page(int(chapter.group(1))).encode('utf-8'))
+                elif re.fullmatch(r'/img/\d+\.png', url.path) and int(url.path[5:-4]) < IMAGE_POOL:
+                    self.send_body(200, site.image(int(url.path[5:-4])), content_type='image/png')
+                elif url.path == f'/cover/{site.slug}.jpg':
+                    # Not a real JPEG, but the right size for a typical cover
+                    self.send_body(200, bytes(range(256)) * 120, content_type='image/jpeg')
+                else:
+                    self.send_body(404, b'<html><body>Not found</body></html>')
+
+        return Handler
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a fake novelfull-style novel locally.")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--chapters', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of chapter requests failing with 429/503")
+    parser.add_argument('--images', type=int, default=0, help="Illustrations per chapter")
+    args = parser.parse_args(argv)
+
+    site = MockNovelSite(chapters=args.chapters, latency=args.latency, jitter=args.jitter,
+                         error_rate=args.error_rate, images=args.images, port=args.port)
+    print(f"Serving {args.chapters} chapters at {site.novel_url}")
+    try:
+        site.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import re
+import hashlib
+import tempfile
+from array import array
+from html import unescape
+
+# Paragraphs as serialized by clean_chapter_html (BeautifulSoup never nests them)
+PARAGRAPH_RE = re.compile(r'<p\b[^>]*>(.*?)</p>', re.S | re.I)
+TAG_RE = re.compile(r'<[^>]+>')
+# Digits are dropped too, so "Read chapter 12 at ..." and "Read chapter 13 at ..." match
+NON_LETTERS_RE = re.compile(r'[\W\d_]+')
+
+# Only paragraphs of this length (after normalization) are fingerprinted: shorter ones
+# are ordinary lines like "What?!", longer ones are story text
+MIN_PARAGRAPH_CHARS = 20
+MAX_PARAGRAPH_CHARS = 600
+
+# A paragraph is boilerplate when it shows up in at least this share of the chapters,
+# and in no fewer than MIN_REPEATS of them. Books shorter than MIN_CHAPTERS are left alone.
+BOILERPLATE_RATIO = 0.1
+MIN_REPEATS = 4
+MIN_CHAPTERS = 10
+
+def fingerprint(paragraph):
+    """
+    Returns a 64-bit hash of the paragraph's normalized text (letters only, lowercased),
+    or None if the paragraph is too short or too long to be considered.
+    """
+    text = NON_LETTERS_RE.sub(' ', unescape(TAG_RE.sub(' ', paragraph))).strip().lower()
+    if not MIN_PARAGRAPH_CHARS <= len(text) <= MAX_PARAGRAPH_CHARS:
+        return None
+    return int.from_bytes(hashlib.blake2b(' '.join(text.split()).encode('utf-8'), digest_size=8).digest(), 'big')
+
+def paragraph_fingerprints(content):
+    """
+    Returns the fingerprint of every paragraph of `content`, in order (None for the
+    ones not considered).
+    """
+    return [fingerprint(m.group(1)) for m in PARAGRAPH_RE.finditer(content)]
+
+class BoilerplateDetector:
+    """
+    Counts in how many chapters each paragraph fingerprint appears.
+    Only the 8-byte fingerprints are kept, not the text.
+    """
+
+    def __init__(self, ratio=BOILERPLATE_RATIO, min_repeats=MIN_REPEATS):
+        self.ratio = ratio
+        self.min_repeats = min_repeats
+        self.counts = {}
+        self.chapters = 0
+
+    def add(self, content, fingerprints=None):
+        # `fingerprints` are the chapter's paragraph_fingerprints, if already computed.
+        # A line repeated inside one chapter still counts once
+        if fingerprints is None:
+            fingerprints = paragraph_fingerprints(content)
+        for fp in set(fingerprints):
+            if fp is not None:
+                self.counts[fp] = self.counts.get(fp, 0) + 1
+        self.chapters += 1
+
+    def boilerplate(self):
+        threshold = max(self.min_repeats, self.ratio * self.chapters)
+        return frozenset(fp for fp, count in self.counts.items() if count >= threshold)
+
+def strip_paragraphs(content, boilerplate, fingerprints=None):
+    """
+    Removes the paragraphs of `content` whose fingerprint is in `boilerplate`.
+    `fingerprints` are the content's paragraph_fingerprints, if already computed.
+    """
+    if not boilerplate:
+        return content
+    if fingerprints is None:
+        return PARAGRAPH_RE.sub(lambda m: '' if fingerprint(m.group(1)) in boilerplate else m.group(0), content)
+    fps = iter(fingerprints)
+    return PARAGRAPH_RE.sub(lambda m: '' if next(fps) in boilerplate else m.group(0), content)
+
+def remove_boilerplate(contents, detector=None, processor=None):
+    """
+    Takes an iterable of chapter contents and yields them back, in order, without
+    the paragraphs repeated across many chapters (watermarks, promos, ads).
+    All chapters have to be seen before anything can be dropped, so they are
+    spooled to a temporary file while the fingerprints are counted, then read back
+    and filtered one at a time; memory stays flat however long the book is.
+    The fingerprints are spooled along with each chapter, so every paragraph is only
+    hashed once; with a ChapterProcessor (see postprocess.py), they are computed in
+    its worker processes.
+    """
+    detector = detector or BoilerplateDetector()
+    if processor is not None:
+        fingerprinted = processor.fingerprints(contents)
+    else:
+        fingerprinted = ((content, paragraph_fingerprints(content)) for content in contents)
+    lengths = []
+    with tempfile.TemporaryFile() as spool:
+        for content, fingerprints in fingerprinted:
+            detector.add(content, fingerprints)
+            data = content.encode('utf-8')
+            # 0 stands for "not fingerprinted" (None) in the spool
+            fps = array('Q', [fp or 0 for fp in fingerprints]).tobytes()
+            lengths.append((len(data), len(fps)))
+            spool.write(data)
+            spool.write(fps)
+
+        boilerplate = detector.boilerplate() if detector.chapters >= MIN_CHAPTERS else frozenset()
+        spool.seek(0)
+        for length, fps_length in lengths:
+            data = spool.read(length)
+            fps = array('Q')
+            fps.frombytes(spool.read(fps_length))
+            yield strip_paragraphs(data.decode('utf-8'), boilerplate, fps)
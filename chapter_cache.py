@@ -0,0 +1,346 @@
+import os
+import sqlite3
+import threading
+import time
+import json
+import zlib
+from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+
+from chapter_index import ChapterIndex
+
+# Default location: a .cache folder next to the app (override with WNEPUB_CACHE_DIR)
+CACHE_DIR = os.environ.get('WNEPUB_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024  # 500 MB
+DEFAULT_MAX_AGE = 7 * 24 * 3600  # Entries younger than this are served without any request
+DEFAULT_INDEX_TTL = 3600  # Chapter lists younger than this are served without any request
+FULL_REFRESH_AGE = 7 * 24 * 3600  # Older chapter lists are crawled again from the first page
+ACCESS_FLUSH_COUNT = 256  # Cache hits whose access time is written back in one transaction
+
+
+class ChapterCache:
+    """
+    Persistent chapter cache keyed by chapter URL, stored in SQLite.
+    Keeps the raw HTML (zlib-compressed) and the cleaned HTML, plus the
+    ETag/Last-Modified validators used to revalidate stale entries.
+    Images (covers and pictures in chapters) are kept the same way, as downloaded.
+    The total size is capped; least recently used entries are evicted first, chapters
+    and images alike.
+    Access times of cache hits are kept in memory and written back in batches.
+    """
+
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, 'chapters.sqlite3')
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.accessed = {}  # (table, url) -> last access time not written back yet
+        # One connection shared by the download threads, serialized by self.lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS chapters ('
+            ' url TEXT PRIMARY KEY,'
+            ' raw_html BLOB,'
+            ' cleaned_html TEXT,'
+            ' etag TEXT,'
+            ' last_modified TEXT,'
+            ' fetched_at REAL,'
+            ' last_access REAL,'
+            ' size INTEGER)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS chapters_last_access ON chapters (last_access)')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS images ('
+            ' url TEXT PRIMARY KEY,'
+            ' data BLOB,'
+            ' etag TEXT,'
+            ' last_modified TEXT,'
+            ' fetched_at REAL,'
+            ' last_access REAL,'
+            ' size INTEGER)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS images_last_access ON images (last_access)')
+        self.conn.commit()
+        self.total_bytes = self.conn.execute(
+            'SELECT (SELECT COALESCE(SUM(size), 0) FROM chapters) + (SELECT COALESCE(SUM(size), 0) FROM images)'
+        ).fetchone()[0]
+
+    def get(self, url):
+        """
+        Returns the cached entry for `url` as a dict (cleaned HTML and validators), or None.
+        The raw HTML is not read: use get_raw for it.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT cleaned_html, etag, last_modified, fetched_at FROM chapters WHERE url = ?', (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._accessed('chapters', url)
+        cleaned_html, etag, last_modified, fetched_at = row
+        return {
+            'url': url,
+            'cleaned_html': cleaned_html,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': fetched_at,
+        }
+
+    def get_raw(self, url):
+        """
+        Returns the raw HTML cached for `url` (decompressed), or None.
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT raw_html FROM chapters WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        return zlib.decompress(row[0]) if row[0] else b''
+
+    def get_image(self, url):
+        """
+        Returns the cached image at `url` as a dict (data as downloaded, and validators), or None.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT data, etag, last_modified, fetched_at FROM images WHERE url = ?', (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._accessed('images', url)
+        data, etag, last_modified, fetched_at = row
+        return {
+            'url': url,
+            'data': data,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': fetched_at,
+        }
+
+    def _accessed(self, table, url):
+        # Called with self.lock held. Only eviction looks at access times: no write and commit per hit
+        self.accessed[table, url] = time.time()
+        if len(self.accessed) >= ACCESS_FLUSH_COUNT:
+            self._flush_access()
+            self.conn.commit()
+
+    def _flush_access(self):
+        # Called with self.lock held; the caller commits
+        for table in ('chapters', 'images'):
+            updates = [(accessed_at, url) for (name, url), accessed_at in self.accessed.items() if name == table]
+            if updates:
+                self.conn.executemany(f'UPDATE {table} SET last_access = ? WHERE url = ?', updates)
+        self.accessed.clear()
+
+    def content_sizes(self, urls):
+        """
+        Returns {url: length of the cleaned HTML} for the cached ones among `urls`,
+        without reading or decompressing the entries.
+        """
+        urls = list(urls)
+        sizes = {}
+        with self.lock:
+            # Stay below SQLite's limit on query parameters
+            for i in range(0, len(urls), 500):
+                chunk = urls[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                sizes.update(self.conn.execute(
+                    f'SELECT url, LENGTH(cleaned_html) FROM chapters WHERE url IN ({placeholders})', chunk
+                ))
+        return sizes
+
+    def is_fresh(self, entry):
+        return time.time() - entry['fetched_at'] < self.max_age
+
+    def validation_headers(self, entry):
+        """
+        Conditional request headers for revalidating a stale entry.
+        """
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, url, raw_html, cleaned_html, etag=None, last_modified=None):
+        compressed = zlib.compress(raw_html)
+        size = len(compressed) + len(cleaned_html.encode('utf-8'))
+        now = time.time()
+        with self.lock:
+            self.accessed.pop(('chapters', url), None)
+            old = self.conn.execute('SELECT size FROM chapters WHERE url = ?', (url,)).fetchone()
+            self.conn.execute(
+                'INSERT OR REPLACE INTO chapters (url, raw_html, cleaned_html, etag, last_modified, fetched_at, last_access, size)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, compressed, cleaned_html, etag, last_modified, now, now, size)
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            # Eviction goes by access time: bring it up to date first
+            self._flush_access()
+            self._evict()
+            self.conn.commit()
+
+    def put_image(self, url, data, etag=None, last_modified=None):
+        now = time.time()
+        with self.lock:
+            self.accessed.pop(('images', url), None)
+            old = self.conn.execute('SELECT size FROM images WHERE url = ?', (url,)).fetchone()
+            self.conn.execute(
+                'INSERT OR REPLACE INTO images (url, data, etag, last_modified, fetched_at, last_access, size)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, data, etag, last_modified, now, now, len(data))
+            )
+            self.total_bytes += len(data) - (old[0] if old else 0)
+            self._flush_access()
+            self._evict()
+            self.conn.commit()
+
+    def touch(self, url, table='chapters'):
+        """
+        Marks an entry (of `table`: chapters or images) as freshly validated
+        (e.g. after a 304 Not Modified).
+        """
+        now = time.time()
+        with self.lock:
+            self.accessed.pop((table, url), None)
+            self.conn.execute(f'UPDATE {table} SET fetched_at = ?, last_access = ? WHERE url = ?', (now, now, url))
+            self.conn.commit()
+
+    def _evict(self):
+        # Drop least recently used entries until we are back under the cap
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT 'chapters', url, size, last_access FROM chapters"
+                " UNION ALL SELECT 'images', url, size, last_access FROM images"
+                ' ORDER BY last_access LIMIT 100'
+            ).fetchall()
+            if not rows:
+                self.total_bytes = 0
+                break
+            for table, url, size, _ in rows:
+                self.conn.execute(f'DELETE FROM {table} WHERE url = ?', (url,))
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM chapters')
+            self.conn.execute('DELETE FROM images')
+            self.conn.commit()
+            self.accessed.clear()
+            self.total_bytes = 0
+
+    def close(self):
+        with self.lock:
+            self._flush_access()
+            self.conn.commit()
+            self.conn.close()
+
+
+def normalize_novel_url(url):
+    """
+    Cache key of a novel's index page: same page whatever the case of the host,
+    a www. prefix, a trailing slash, a fragment or a ?page= parameter.
+    """
+    parsed = urlparse(url.strip())
+    host = parsed.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parsed.query) if k != 'page'))
+    return urlunparse((parsed.scheme.lower() or 'https', host, parsed.path.rstrip('/') or '/', '', query, ''))
+
+
+class IndexCache:
+    """
+    Chapter lists of analyzed novels, shared by every session and stored in SQLite.
+    Besides the chapters, title, author and cover, an entry remembers how many
+    index pages the novel had and how many chapters came before its last page,
+    so a refresh only has to fetch the last page onwards.
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_INDEX_TTL, full_refresh_age=FULL_REFRESH_AGE):
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, 'index.sqlite3')
+        self.path = path
+        self.ttl = ttl
+        self.full_refresh_age = full_refresh_age
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS novels ('
+            ' url TEXT PRIMARY KEY,'
+            ' title TEXT,'
+            ' author TEXT,'
+            ' cover_url TEXT,'
+            ' chapters BLOB,'
+            ' last_page INTEGER,'
+            ' stable_count INTEGER,'
+            ' fetched_at REAL,'
+            ' crawled_at REAL)'
+        )
+        self.conn.commit()
+
+    def get(self, url):
+        """
+        Returns the cached analysis of the novel at `url` as a dict, or None.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT title, author, cover_url, chapters, last_page, stable_count, fetched_at, crawled_at'
+                ' FROM novels WHERE url = ?', (normalize_novel_url(url),)
+            ).fetchone()
+        if row is None:
+            return None
+        title, author, cover_url, chapters, last_page, stable_count, fetched_at, crawled_at = row
+        return {
+            'title': title,
+            'author': author,
+            'cover_url': cover_url,
+            'chapters': ChapterIndex.from_json(json.loads(zlib.decompress(chapters))),
+            'last_page': last_page,
+            'stable_count': stable_count,
+            'fetched_at': fetched_at,
+            'crawled_at': crawled_at,
+        }
+
+    def is_fresh(self, entry):
+        return time.time() - entry['fetched_at'] < self.ttl
+
+    def needs_full_crawl(self, entry):
+        return time.time() - entry['crawled_at'] >= self.full_refresh_age
+
+    def put(self, url, chapters, title, author, cover_url, last_page, stable_count, full_crawl=True):
+        """
+        Stores a novel's analysis (`chapters` is a ChapterIndex). `stable_count` is the number of chapters listed before
+        the last index page; `full_crawl` tells whether every index page was fetched.
+        """
+        now = time.time()
+        key = normalize_novel_url(url)
+        data = zlib.compress(json.dumps(chapters.to_json(), ensure_ascii=False).encode('utf-8'))
+        with self.lock:
+            if full_crawl:
+                crawled_at = now
+            else:
+                row = self.conn.execute('SELECT crawled_at FROM novels WHERE url = ?', (key,)).fetchone()
+                crawled_at = row[0] if row else now
+            self.conn.execute(
+                'INSERT OR REPLACE INTO novels (url, title, author, cover_url, chapters, last_page, stable_count, fetched_at, crawled_at)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, title, author, cover_url, data, last_page, stable_count, now, crawled_at)
+            )
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM novels')
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,181 @@
+import re
+from collections.abc import Sequence
+
+CHAPTER_NUMBER_RE = re.compile(r'Chapter\s+(\d+)', re.IGNORECASE)
+
+def extract_chapter_number(title):
+    match = CHAPTER_NUMBER_RE.search(title)
+    if match:
+        return int(match.group(1))
+    return None
+
+class Chapter:
+    """
+    One entry of a chapter list. Besides .title and .url, it reads like the
+    {'Title': ..., 'URL': ...} dicts used in job parameters and ePub source records,
+    so both can go through the download and ePub code.
+    """
+    __slots__ = ('title', 'url')
+
+    def __init__(self, title, url):
+        self.title = title
+        self.url = url
+
+    def __getitem__(self, key):
+        if key == 'Title':
+            return self.title
+        if key == 'URL':
+            return self.url
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __eq__(self, other):
+        try:
+            return self.title == other['Title'] and self.url == other['URL']
+        except (KeyError, TypeError):
+            return NotImplemented
+
+    def __repr__(self):
+        return f'Chapter({self.title!r}, {self.url!r})'
+
+class ChapterIndex(Sequence):
+    """
+    The chapter list of a novel, stored as two parallel lists (titles and URLs)
+    plus one URL -> position map, instead of a dict per chapter.
+    Adding a chapter whose URL is already listed is a no-op, checked in O(1);
+    slicing returns a ChapterRange view without copying anything; a chapter can
+    be looked up by its URL or by the number in its title ("Chapter 12: ...").
+    """
+
+    def __init__(self, chapters=()):
+        self.titles = []
+        self.urls = []
+        self.positions = {}  # url -> position
+        self._numbers = None  # chapter number -> position, built on the first lookup
+        self.extend(chapters)
+
+    def add(self, title, url):
+        """
+        Appends a chapter, unless its URL is already listed. Returns whether it was added.
+        """
+        if url in self.positions:
+            return False
+        self.positions[url] = len(self.urls)
+        self.titles.append(title)
+        self.urls.append(url)
+        self._numbers = None
+        return True
+
+    def extend(self, chapters):
+        # Takes Chapter records or {'Title', 'URL'} dicts; returns how many were new
+        added = 0
+        for chapter in chapters:
+            added += self.add(chapter['Title'], chapter['URL'])
+        return added
+
+    def __len__(self):
+        return len(self.urls)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self.urls))
+            if step != 1:
+                raise ValueError("Chapter ranges can't have a step")
+            return ChapterRange(self, start, max(start, stop))
+        return Chapter(self.titles[i], self.urls[i])
+
+    def __iter__(self):
+        return map(Chapter, self.titles, self.urls)
+
+    def __eq__(self, other):
+        if isinstance(other, ChapterIndex):
+            return self.titles == other.titles and self.urls == other.urls
+        return same_chapters(self, other)
+
+    def __contains__(self, chapter):
+        url = chapter if isinstance(chapter, str) else chapter['URL']
+        return url in self.positions
+
+    def index_of(self, url):
+        """
+        Returns the position of the chapter with this URL, or None.
+        """
+        return self.positions.get(url)
+
+    def find_number(self, number):
+        """
+        Returns the position of the first chapter whose title has this number, or None.
+        """
+        if self._numbers is None:
+            numbers = {}
+            for position, title in enumerate(self.titles):
+                n = extract_chapter_number(title)
+                if n is not None and n not in numbers:
+                    numbers[n] = position
+            self._numbers = numbers
+        return self._numbers.get(number)
+
+    def to_json(self):
+        return {'titles': self.titles, 'urls': self.urls}
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Rebuilds an index from to_json() output, or from a list of {'Title', 'URL'} dicts.
+        """
+        if isinstance(data, list):
+            return cls(data)
+        index = cls()
+        for title, url in zip(data['titles'], data['urls']):
+            index.add(title, url)
+        return index
+
+class ChapterRange(Sequence):
+    """
+    A slice of a ChapterIndex that reads the index's lists in place.
+    """
+
+    def __init__(self, index, start, stop):
+        self.index = index
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                raise ValueError("Chapter ranges can't have a step")
+            return ChapterRange(self.index, self.start + start, self.start + max(start, stop))
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('chapter range index out of range')
+        return self.index[self.start + i]
+
+    def __eq__(self, other):
+        return same_chapters(self, other)
+
+    def __iter__(self):
+        titles, urls = self.index.titles, self.index.urls
+        for i in range(self.start, self.stop):
+            yield Chapter(titles[i], urls[i])
+
+def same_chapters(chapters, other):
+    # Chapter lists compare equal to any sequence of the same records (or dicts)
+    if not isinstance(other, (Sequence, ChapterIndex)) or isinstance(other, str):
+        return NotImplemented
+    return len(chapters) == len(other) and all(a == b for a, b in zip(chapters, other))
+
+def chapter_dicts(chapters):
+    """
+    Returns the chapters as a list of {'Title', 'URL'} dicts, e.g. to store them as JSON.
+    """
+    return [{'Title': chapter['Title'], 'URL': chapter['URL']} for chapter in chapters]
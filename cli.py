@@ -0,0 +1,190 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import contextlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import images
+import metrics
+import http_client
+import postprocess
+from chapter_cache import ChapterCache, IndexCache
+from scraper import DEFAULT_MAX_WORKERS, DEFAULT_REQUESTS_PER_SECOND, get_chapters
+from epub_builder import build_book_title, create_epub, create_volumes, bundle_volumes, safe_filename
+
+_print_lock = threading.Lock()
+
+def emit(event, **fields):
+    """
+    Prints one machine-readable progress record (a JSON object per line) to stdout.
+    """
+    record = {'event': event, 'time': round(time.time(), 3)}
+    record.update(fields)
+    line = json.dumps(record, ensure_ascii=False)
+    with _print_lock:
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+def read_batch_file(path):
+    """
+    Reads a batch file: one novel index URL per line, optionally followed by a
+    chapter range ("1-100", "50-", "-20"). Blank lines and # comments are ignored.
+    Returns a list of (url, range_spec) pairs; range_spec is None for all chapters.
+    """
+    f = sys.stdin if path == '-' else open(path, encoding='utf-8')
+    jobs = []
+    try:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = line.split()
+            jobs.append((parts[0], parts[1] if len(parts) > 1 else None))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    return jobs
+
+def parse_range(range_spec, total):
+    """
+    Turns a 1-based inclusive range spec into (start, end), clamped to the chapters found.
+    """
+    if not range_spec:
+        return 1, total
+    match = re.fullmatch(r'(\d*)-(\d*)|(\d+)', range_spec)
+    if not match:
+        raise ValueError(f"Invalid chapter range: {range_spec!r}")
+    if match.group(3):
+        start = end = int(match.group(3))
+    else:
+        start = int(match.group(1)) if match.group(1) else 1
+        end = int(match.group(2)) if match.group(2) else total
+    start, end = max(1, start), min(total, end)
+    if start > end:
+        raise ValueError(f"Empty chapter range {range_spec!r} ({total} chapters found)")
+    return start, end
+
+def export_novel(url, range_spec, args, cache, index_cache=None):
+    """
+    Analyzes one novel and writes the selected chapter range as an ePub into args.output_dir,
+    or as several volumes when splitting is requested.
+    Returns the path of the written file (the list of volumes, or their zip, when split).
+    """
+    emit('analyze', url=url)
+    chapters_data, title, cover_url, author = get_chapters(url, max_workers=args.workers, requests_per_second=args.rate,
+                                                           index_cache=index_cache)
+    if not chapters_data:
+        raise ValueError("No chapters found")
+
+    start_idx, end_idx = parse_range(range_spec, len(chapters_data))
+    selected_chapters = chapters_data[start_idx-1 : end_idx]
+    book_title = build_book_title(title, selected_chapters, start_idx, end_idx)
+    emit('analyzed', url=url, title=title, author=author, chapters=len(chapters_data), start=start_idx, end=end_idx)
+
+    def report_progress(done, total, chap_title):
+        emit('progress', url=url, done=done, total=total, chapter=chap_title)
+
+    options = dict(max_workers=args.workers, requests_per_second=args.rate, cache=cache, source_url=url,
+                   strip_boilerplate=not args.keep_boilerplate, images=not args.no_images,
+                   image_max_size=args.image_max_size, image_quality=args.image_quality,
+                   skip_missing=not args.fail_on_missing)
+
+    if args.volume_chapters or args.volume_size:
+        volumes = create_volumes(title, author, selected_chapters, args.output_dir, report_progress, cover_url,
+                                 start_idx=start_idx, chapters_per_volume=args.volume_chapters,
+                                 max_volume_bytes=args.volume_size and args.volume_size * 1024 * 1024, **options)
+        paths = [path for _, path in volumes]
+        if not args.zip:
+            return paths
+        zip_path = bundle_volumes(paths, os.path.join(args.output_dir, safe_filename(book_title) + '.zip'))
+        for path in paths:
+            os.remove(path)
+        return zip_path
+
+    output_path = os.path.join(args.output_dir, safe_filename(book_title) + '.epub')
+    create_epub(book_title, author, selected_chapters, report_progress, cover_url, output_path=output_path, **options)
+    return output_path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export web novels to ePub without the Streamlit UI. "
+                    "Progress is printed to stdout as one JSON object per line.")
+    parser.add_argument('batch_file', help="File with one novel URL per line, optionally followed by a chapter range "
+                                           "like 1-100, 50- or -20 ('-' reads from stdin)")
+    parser.add_argument('-o', '--output-dir', default='.', help="Where to write the ePubs (default: current directory)")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="Number of novels exported in parallel (default: 1)")
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_MAX_WORKERS,
+                        help=f"Parallel chapter downloads per novel (default: {DEFAULT_MAX_WORKERS})")
+    parser.add_argument('-r', '--rate', type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help=f"Max requests per second per site, shared by all novels (default: {DEFAULT_REQUESTS_PER_SECOND})")
+    parser.add_argument('--no-cache', action='store_true', help="Don't read or write the chapter and index caches")
+    parser.add_argument('--keep-boilerplate', action='store_true',
+                        help="Don't remove paragraphs repeated across many chapters (watermarks, promos)")
+    parser.add_argument('--no-images', action='store_true', help="Don't download and embed the chapters' images")
+    parser.add_argument('--image-max-size', type=int, default=images.DEFAULT_MAX_SIZE,
+                        help=f"Downscale images to this many pixels on their longest side (default: {images.DEFAULT_MAX_SIZE})")
+    parser.add_argument('--image-quality', type=int, default=images.DEFAULT_QUALITY,
+                        help=f"JPEG quality of recompressed images (default: {images.DEFAULT_QUALITY})")
+    parser.add_argument('--fail-on-missing', action='store_true',
+                        help="Fail a novel when a chapter page is gone (404...) or has no text, instead of leaving the chapter out")
+    parser.add_argument('--volume-chapters', type=int, help="Split each novel into volumes of this many chapters")
+    parser.add_argument('--volume-size', type=float, help="Split each novel into volumes of about this many MB")
+    parser.add_argument('--zip', action='store_true', help="Deliver the volumes of a split novel as one zip")
+    parser.add_argument('--timeout', type=float, default=http_client.DEFAULT_READ_TIMEOUT,
+                        help=f"Read timeout per request in seconds (default: {http_client.DEFAULT_READ_TIMEOUT})")
+    parser.add_argument('--max-per-host', type=int, default=http_client.DEFAULT_MAX_PER_HOST,
+                        help=f"Max requests in flight per site, shared by all novels (default: {http_client.DEFAULT_MAX_PER_HOST})")
+    parser.add_argument('--max-page-size', type=float, default=http_client.DEFAULT_MAX_BODY_BYTES / (1024 * 1024),
+                        help="Pages are cut off past this many MB (default: %(default)g)")
+    parser.add_argument('--retries', type=int, default=http_client.DEFAULT_RETRIES,
+                        help=f"Retries on timeouts, 429 and 5xx responses (default: {http_client.DEFAULT_RETRIES})")
+    parser.add_argument('--processes', type=int, default=postprocess.DEFAULT_PROCESSES,
+                        help="Worker processes for parsing, cleaning and boilerplate detection, shared by all novels; "
+                             f"1 keeps them in this process (default: {postprocess.DEFAULT_PROCESSES})")
+    parser.add_argument('--metrics-file',
+                        help="Keep writing pipeline metrics to this file (Prometheus text if it ends in .prom, JSON otherwise)")
+    parser.add_argument('--profile', help="Profile the whole batch with cProfile and save the stats to this file")
+    args = parser.parse_args(argv)
+
+    # Enough pooled connections for every download running at the same time
+    http_client.configure(pool_size=max(http_client.DEFAULT_POOL_SIZE, args.jobs * args.workers),
+                          read_timeout=args.timeout, retries=args.retries, max_per_host=args.max_per_host,
+                          max_body_bytes=int(args.max_page_size * 1024 * 1024))
+    postprocess.configure(processes=args.processes)
+    postprocess.get_processor()
+
+    jobs = read_batch_file(args.batch_file)
+    os.makedirs(args.output_dir, exist_ok=True)
+    cache = None if args.no_cache else ChapterCache()
+    index_cache = None if args.no_cache else IndexCache()
+
+    def run(job):
+        url, range_spec = job
+        started = time.time()
+        try:
+            path = export_novel(url, range_spec, args, cache, index_cache)
+        except Exception as e:
+            emit('error', url=url, error=str(e))
+            return False
+        emit('done', url=url, path=path, seconds=round(time.time() - started, 2))
+        return True
+
+    if args.metrics_file:
+        metrics.start_metrics_writer(args.metrics_file)
+
+    emit('start', novels=len(jobs))
+    with metrics.profiled(args.profile) if args.profile else contextlib.nullcontext():
+        with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+            results = list(executor.map(run, jobs))
+    if args.metrics_file:
+        metrics.write_metrics(args.metrics_file)
+    emit('finished', novels=len(jobs), failed=results.count(False),
+         stage_seconds={stage: round(seconds, 3) for stage, seconds in metrics.stage_seconds().items()})
+    return 0 if all(results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,303 @@
+import os
+import sys
+import re
+import json
+import time
+import uuid
+import queue
+import zipfile
+import contextlib
+from collections import deque
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from epub_writer import StreamingEpubWriter, EpubReader, escape
+from chapter_index import extract_chapter_number
+from job_journal import JobJournal
+from postprocess import get_processor
+from boilerplate import remove_boilerplate
+from images import DEFAULT_MAX_SIZE, DEFAULT_QUALITY, COVER_MAX_SIZE, IMAGE_TYPES, ImagePipeline, copy_images, fetch_image, recompress
+from scraper import DEFAULT_MAX_WORKERS, DEFAULT_REQUESTS_PER_SECOND, download_chapters, get_rate_limiter
+
+def build_book_title(title, book_chapters, start_idx, end_idx):
+    """
+    Names a book after the chapter range it contains, e.g. "My Novel 1-250".
+    Tries to parse numbers from the first and last chapter titles,
+    falling back to the selected index range.
+    """
+    if not book_chapters:
+        return f"{title}"
+    
+    first_num = extract_chapter_number(book_chapters[0]['Title'])
+    last_num = extract_chapter_number(book_chapters[-1]['Title'])
+    
+    if first_num is not None and last_num is not None:
+         range_str = f" {first_num}-{last_num}"
+    else:
+         range_str = f" {start_idx}-{end_idx}" # Fallback to index
+         
+    return f"{title}{range_str}"
+
+# Where create_epub records the novel URL and the source URL of every chapter
+EPUB_SOURCE_FILE = 'meta/source.json'
+
+def read_existing_epub(epub_file):
+    """
+    Opens a previously generated ePub (path or file-like object) for update mode.
+    Returns a dict with the EpubReader, the book identifier and the chapters recorded
+    when the book was built ({'Title', 'URL', 'file_name'} entries, in reading order).
+    Books built before the source record existed fall back to their table of
+    contents, with 'URL' set to None.
+    """
+    reader = EpubReader(epub_file)
+    
+    source = reader.read(EPUB_SOURCE_FILE)
+    if source:
+        chapters = json.loads(source)['chapters']
+    else:
+        chapters = [{'Title': title, 'URL': None, 'file_name': href} for title, href in reader.toc()]
+    return {'reader': reader, 'identifier': reader.identifier(), 'chapters': chapters}
+
+def find_new_chapters(chapters_data, existing_chapters):
+    """
+    Returns the chapters of chapters_data that are not already in the book.
+    Chapters are matched by URL, or by title for books without a source record.
+    """
+    known_urls = set(c['URL'] for c in existing_chapters if c['URL'])
+    known_titles = set(c['Title'] for c in existing_chapters if not c['URL'])
+    return [c for c in chapters_data if c['URL'] not in known_urls and c['Title'] not in known_titles]
+
+@contextlib.contextmanager
+def atomic_output(output_path):
+    """
+    Yields a temporary path next to `output_path` to write a file into; the file is
+    moved into place only if the block succeeds, and deleted otherwise, so a failed
+    export never leaves a broken file under the real name.
+    """
+    temp_path = f'{output_path}.{uuid.uuid4().hex[:8]}.part'
+    try:
+        yield temp_path
+        os.replace(temp_path, output_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+def create_epub(title, author, chapters_data, progress_callback=None, cover_url=None, max_workers=DEFAULT_MAX_WORKERS, requests_per_second=DEFAULT_REQUESTS_PER_SECOND, cache=None, source_url=None, base=None, output_path=None, resume=True, strip_boilerplate=True, images=True, image_max_size=DEFAULT_MAX_SIZE, image_quality=DEFAULT_QUALITY, skip_missing=True):
+    """
+    Downloads the chapters and streams them into an ePub.
+    Each chapter is written into the zip container as soon as it is cleaned, so memory
+    use does not grow with the number of chapters. The book is written to `output_path`
+    (returned) if given, otherwise to an in-memory buffer (returned, rewound). If the
+    export fails, nothing is left at `output_path`.
+    In update mode, `base` is the dict returned by read_existing_epub: its chapters are
+    copied over as they are and chapters_data is appended after them.
+    progress_callback(done, total, chapter_title) is called after each chapter.
+    With `resume`, downloaded chapters are checkpointed in a job journal: if the run dies,
+    calling create_epub again for the same chapters only downloads the missing ones.
+    With `strip_boilerplate`, paragraphs repeated across many chapters (watermarks, promos)
+    are dropped; the chapters are then only written once all of them are downloaded.
+    With `images`, pictures in the chapters are downloaded, downscaled to `image_max_size`
+    pixels, recompressed at `image_quality` (if Pillow is installed) and embedded in the book.
+    With `skip_missing`, chapters whose page is gone (404...) or has no chapter text are
+    left out of the book with a warning; otherwise the export fails on the first one.
+    Parsing and cleaning downloaded pages, and fingerprinting paragraphs, run in the shared
+    pool of worker processes (see postprocess.py); the chapters still come back in order.
+    """
+    # Keep the identifier in update mode so readers treat the result as the same book
+    identifier = (base and base['identifier']) or f'id_{int(time.time())}'
+    buffer = None if output_path else BytesIO()
+    journal = JobJournal.open_for(source_url, chapters_data) if resume and chapters_data else None
+    
+    # The journal is discarded once the book is complete (and kept if the export fails);
+    # a book written to a file only shows up under its name once it is complete
+    with journal or contextlib.nullcontext(), \
+            atomic_output(output_path) if output_path else contextlib.nullcontext(buffer) as output, \
+            StreamingEpubWriter(output, title, author, identifier, language='en', source_url=source_url) as writer:
+        # Add Cover if available
+        if cover_url:
+            try:
+                content = fetch_image(cover_url, get_rate_limiter(cover_url, requests_per_second), cache)
+                if content is not None:
+                    data, fmt = recompress(content, max(image_max_size, COVER_MAX_SIZE), image_quality)
+                    extension = IMAGE_TYPES[fmt][1] if fmt else 'jpg'
+                    writer.set_cover(f"cover.{extension}", data)
+            except Exception as e:
+                print(f"Could not add cover: {e}", file=sys.stderr)
+
+        # Define CSS style
+        style = 'body { font-family: Times, serif; }'
+        writer.add_item("style_nav", "style/nav.css", style, media_type="text/css")
+
+        source_chapters = []
+        existing_images = set()
+        
+        # Update mode: copy the existing chapter documents without re-downloading or re-parsing them
+        if base:
+            existing_images = copy_images(base['reader'], writer)
+            for entry in base['chapters']:
+                document = base['reader'].read(entry['file_name'])
+                if document is None:
+                    continue
+                writer.add_chapter_document(entry['Title'], document, entry['file_name'])
+                source_chapters.append(entry)
+        used_file_names = set(c['file_name'] for c in source_chapters)
+        
+        # Concurrent download, throttled per host instead of a fixed anti-ban sleep;
+        # the CPU-bound stages go to the worker processes, if there are any
+        processor = get_processor()
+        contents = download_chapters(chapters_data, max_workers, requests_per_second, progress_callback, cache=cache,
+                                     journal=journal, processor=processor, skip_missing=skip_missing)
+        # Skipped chapters (None) are left out; the chapters kept are paired back with their
+        # content in order, after boilerplate removal
+        kept = deque()
+
+        def present(downloads):
+            for chapter_info, content in downloads:
+                if content is not None:
+                    kept.append(chapter_info)
+                    yield content
+
+        contents = present(zip(chapters_data, contents))
+        if strip_boilerplate:
+            contents = remove_boilerplate(contents, processor=processor)
+        chapters = ((kept.popleft(), content) for content in contents)
+        if images:
+            pipeline = ImagePipeline(writer, max_workers, requests_per_second, image_max_size, image_quality, existing=existing_images, cache=cache)
+            chapters = pipeline.inline(chapters)
+        
+        for chapter_info, content in chapters:
+            chap_title = chapter_info['Title']
+            
+            # New chapters continue the numbering of the existing ones
+            n = len(source_chapters) + 1
+            while f'chap_{n}.xhtml' in used_file_names:
+                n += 1
+            file_name = f'chap_{n}.xhtml'
+            used_file_names.add(file_name)
+            
+            with metrics.timed('epub_write'):
+                writer.add_chapter(chap_title, f'<h1>{escape(chap_title)}</h1>{content}', file_name)
+            source_chapters.append({'Title': chap_title, 'URL': chapter_info['URL'], 'file_name': file_name})
+            
+        # Record where every chapter came from, so the book can be updated later
+        source = {'source_url': source_url, 'chapters': source_chapters}
+        writer.add_item("source", EPUB_SOURCE_FILE, json.dumps(source, ensure_ascii=False), media_type="application/json")
+
+    if output_path:
+        return output_path
+    buffer.seek(0)
+    return buffer
+
+# Volume splitting
+DEFAULT_PARALLEL_VOLUMES = 2
+# Used to turn a target ePub size into chapter counts before anything is downloaded:
+# cleaned XHTML of a typical web novel chapter, and how much of it is left after deflate
+DEFAULT_CHAPTER_BYTES = 16 * 1024
+ZIP_RATIO = 0.35
+
+def safe_filename(name):
+    return re.sub(r'[\\/:*?"<>|\x00-\x1f]+', '_', name).strip() or 'novel'
+
+def plan_volumes(chapters_data, chapters_per_volume=None, max_volume_bytes=None, cache=None):
+    """
+    Splits chapters_data into consecutive volumes, returned as (start, end) slice bounds.
+    Volumes hold `chapters_per_volume` chapters each, or as many as fit in roughly
+    `max_volume_bytes` of ePub. Sizes come from the chapter cache when it has the
+    chapters; the others are assumed to be as long as the average cached one.
+    """
+    total = len(chapters_data)
+    if chapters_per_volume:
+        step = max(1, int(chapters_per_volume))
+        return [(start, min(start + step, total)) for start in range(0, total, step)]
+    if not max_volume_bytes:
+        return [(0, total)] if total else []
+
+    sizes = cache.content_sizes(c['URL'] for c in chapters_data) if cache else {}
+    default_size = sum(sizes.values()) / len(sizes) if sizes else DEFAULT_CHAPTER_BYTES
+    volumes = []
+    start = 0
+    volume_bytes = 0
+    for i, chapter_info in enumerate(chapters_data):
+        chapter_bytes = sizes.get(chapter_info['URL'], default_size) * ZIP_RATIO
+        if i > start and volume_bytes + chapter_bytes > max_volume_bytes:
+            volumes.append((start, i))
+            start = i
+            volume_bytes = 0
+        volume_bytes += chapter_bytes
+    if start < total:
+        volumes.append((start, total))
+    return volumes
+
+def create_volumes(title, author, chapters_data, output_dir, progress_callback=None, cover_url=None, start_idx=1,
+                   chapters_per_volume=None, max_volume_bytes=None, parallel_volumes=DEFAULT_PARALLEL_VOLUMES,
+                   max_workers=DEFAULT_MAX_WORKERS, cache=None, **options):
+    """
+    Splits the chapters into volumes (see plan_volumes) and writes one ePub per volume
+    into `output_dir`, building `parallel_volumes` of them at a time. Every volume has its
+    own table of contents and is named after its chapter range like a single book, with
+    `start_idx` the position of chapters_data[0] in the novel; its file name starts with
+    its number ("01 - My Novel 1-250.epub").
+    The `max_workers` download threads are shared out between the volumes being built.
+    progress_callback(done, total, chapter_title) counts chapters over all volumes and,
+    as with create_epub, is called from the calling thread.
+    Other keyword arguments are passed on to create_epub.
+    Returns [(volume_title, path)] in reading order. If a volume fails, the volumes not
+    started yet are skipped, the ones already written are deleted and the error is raised.
+    """
+    volumes = plan_volumes(chapters_data, chapters_per_volume, max_volume_bytes, cache)
+    if not volumes:
+        return []
+    parallel = max(1, min(int(parallel_volumes), len(volumes)))
+    workers = max(1, int(max_workers) // parallel)
+    events = queue.Queue()
+
+    # Volume titles needn't be unique (numbering restarting in every "Book"): the file
+    # names start with the volume's position, which also keeps them in reading order
+    digits = max(2, len(str(len(volumes))))
+
+    def build(number, start, end):
+        volume_chapters = chapters_data[start:end]
+        volume_title = build_book_title(title, volume_chapters, start_idx + start, start_idx + end - 1)
+        path = os.path.join(output_dir, f'{number:0{digits}d} - {safe_filename(volume_title)}.epub')
+        create_epub(volume_title, author, volume_chapters, lambda done, total, chap_title: events.put(chap_title),
+                    cover_url, max_workers=workers, cache=cache, output_path=path, **options)
+        return volume_title, path
+
+    os.makedirs(output_dir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = [executor.submit(build, number, start, end) for number, (start, end) in enumerate(volumes, start=1)]
+        done = 0
+        while True:
+            try:
+                chap_title = events.get(timeout=0.1)
+            except queue.Empty:
+                if any(future.done() and future.exception() is not None for future in futures):
+                    for future in futures:
+                        future.cancel()
+                if all(future.done() for future in futures):
+                    break
+                continue
+            done += 1
+            if progress_callback:
+                progress_callback(done, len(chapters_data), chap_title)
+
+        errors = [future.exception() for future in futures if not future.cancelled() and future.exception() is not None]
+        if errors:
+            # A novel is delivered whole or not at all
+            for future in futures:
+                if not future.cancelled() and future.exception() is None:
+                    with contextlib.suppress(OSError):
+                        os.remove(future.result()[1])
+            raise errors[0]
+        return [future.result() for future in futures]
+
+def bundle_volumes(paths, zip_path):
+    """
+    Packs the volume ePubs into a single zip (stored: ePubs are compressed already).
+    """
+    with atomic_output(zip_path) as output, zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED) as bundle:
+        for path in paths:
+            bundle.write(path, os.path.basename(path))
+    return zip_path
@@ -0,0 +1,245 @@
+import mimetypes
+import posixpath
+import time
+import zipfile
+from xml.etree import ElementTree
+from html import escape as html_escape
+
+# Same layout as EbookLib: everything lives under EPUB/ in the container
+ROOT_DIR = 'EPUB'
+
+CONTAINER_XML = '''<?xml version="1.0" encoding="utf-8"?>
+<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container" version="1.0">
+  <rootfiles>
+    <rootfile media-type="application/oebps-package+xml" full-path="EPUB/content.opf"/>
+  </rootfiles>
+</container>
+'''
+
+XHTML_TEMPLATE = '''<?xml version='1.0' encoding='utf-8'?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="{lang}" xml:lang="{lang}">
+<head>
+<title>{title}</title>
+</head>
+<body>{body}</body>
+</html>
+'''
+
+def escape(data):
+    # Same as xml.sax.saxutils.escape, which would pull in urllib.request and http.client on import
+    return html_escape(data, quote=False)
+
+def quoteattr(data):
+    """
+    Escapes `data` for an XML attribute value and quotes it, like xml.sax.saxutils.quoteattr.
+    """
+    data = escape(data).replace('\n', '&#10;').replace('\r', '&#13;').replace('\t', '&#9;')
+    if '"' in data:
+        if "'" in data:
+            return '"%s"' % data.replace('"', '&quot;')
+        return "'%s'" % data
+    return '"%s"' % data
+
+OPF_NS = '{http://www.idpf.org/2007/opf}'
+DC_NS = '{http://purl.org/dc/elements/1.1/}'
+NCX_NS = '{http://www.daisy.org/z3986/2005/ncx/}'
+CONTAINER_NS = '{urn:oasis:names:tc:opendocument:xmlns:container}'
+
+
+class StreamingEpubWriter:
+    """
+    Writes an ePub 3 (with an NCX table of contents for older readers) straight
+    into a zip container. Every chapter is compressed into the archive as soon
+    as it is added; only its file name and title are kept until close(), where
+    the package document, NCX and navigation document are written.
+
+    `output` can be a path or a writable binary file object.
+    """
+
+    def __init__(self, output, title, author, identifier, language='en', source_url=None):
+        self.title = title
+        self.author = author
+        self.identifier = identifier
+        self.language = language
+        self.source_url = source_url
+        self.manifest = []  # (id, href, media_type, properties)
+        self.chapters = []  # (id, href, title)
+        self.cover_id = None
+        self.zip = zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED)
+        # The mimetype entry must come first and be stored uncompressed
+        self.zip.writestr(zipfile.ZipInfo('mimetype'), 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+        self.zip.writestr('META-INF/container.xml', CONTAINER_XML)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.zip.close()
+
+    def add_item(self, uid, file_name, content, media_type=None, properties=None):
+        """
+        Writes an arbitrary file (image, stylesheet, JSON...) into the book.
+        """
+        if media_type is None:
+            media_type = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+        self.zip.writestr(f'{ROOT_DIR}/{file_name}', content)
+        self.manifest.append((uid, file_name, media_type, properties))
+
+    def set_cover(self, file_name, content):
+        self.add_item('cover-img', file_name, content, properties='cover-image')
+        body = f'<img src={quoteattr(file_name)} alt="Cover"/>'
+        page = XHTML_TEMPLATE.format(lang=self.language, title='Cover', body=body)
+        self.add_item('cover', 'cover.xhtml', page, media_type='application/xhtml+xml')
+        self.cover_id = 'cover-img'
+
+    def add_chapter(self, title, body, file_name=None):
+        """
+        Wraps an XHTML body fragment into a chapter document and writes it out.
+        Returns the chapter's file name.
+        """
+        file_name = file_name or f'chap_{len(self.chapters) + 1}.xhtml'
+        page = XHTML_TEMPLATE.format(lang=self.language, title=escape(title), body=body)
+        return self.add_chapter_document(title, page, file_name)
+
+    def add_chapter_document(self, title, document, file_name):
+        """
+        Writes an already complete XHTML chapter document (e.g. copied from an existing ePub).
+        """
+        uid = f'chap_{len(self.chapters) + 1}'
+        self.add_item(uid, file_name, document, media_type='application/xhtml+xml')
+        self.chapters.append((uid, file_name, title))
+        return file_name
+
+    def close(self):
+        self._write_nav()
+        self._write_ncx()
+        self._write_opf()
+        self.zip.close()
+
+    def _write_nav(self):
+        with self.zip.open(f'{ROOT_DIR}/nav.xhtml', 'w') as f:
+            title = escape(self.title)
+            f.write(XHTML_TEMPLATE.split('{body}')[0].format(lang=self.language, title=title).encode('utf-8'))
+            f.write(f'<nav epub:type="toc" id="id" role="doc-toc">\n<h2>{title}</h2>\n<ol>\n'.encode('utf-8'))
+            for _, href, chap_title in self.chapters:
+                f.write(f'<li><a href={quoteattr(href)}>{escape(chap_title)}</a></li>\n'.encode('utf-8'))
+            f.write(b'</ol>\n</nav>')
+            f.write(XHTML_TEMPLATE.split('{body}')[1].encode('utf-8'))
+        self.manifest.append(('nav', 'nav.xhtml', 'application/xhtml+xml', 'nav'))
+
+    def _write_ncx(self):
+        with self.zip.open(f'{ROOT_DIR}/toc.ncx', 'w') as f:
+            f.write((
+                "<?xml version='1.0' encoding='utf-8'?>\n"
+                '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">\n'
+                '<head>\n'
+                f'<meta content={quoteattr(self.identifier)} name="dtb:uid"/>\n'
+                '<meta content="0" name="dtb:depth"/>\n'
+                '<meta content="0" name="dtb:totalPageCount"/>\n'
+                '<meta content="0" name="dtb:maxPageNumber"/>\n'
+                '</head>\n'
+                f'<docTitle><text>{escape(self.title)}</text></docTitle>\n'
+                '<navMap>\n'
+            ).encode('utf-8'))
+            for uid, href, chap_title in self.chapters:
+                f.write((
+                    f'<navPoint id="{uid}"><navLabel><text>{escape(chap_title)}</text></navLabel>'
+                    f'<content src={quoteattr(href)}/></navPoint>\n'
+                ).encode('utf-8'))
+            f.write(b'</navMap>\n</ncx>\n')
+        self.manifest.append(('ncx', 'toc.ncx', 'application/x-dtbncx+xml', None))
+
+    def _write_opf(self):
+        modified = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        with self.zip.open(f'{ROOT_DIR}/content.opf', 'w') as f:
+            f.write((
+                "<?xml version='1.0' encoding='utf-8'?>\n"
+                '<package xmlns="http://www.idpf.org/2007/opf" unique-identifier="id" version="3.0">\n'
+                '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:opf="http://www.idpf.org/2007/opf">\n'
+                f'<meta property="dcterms:modified">{modified}</meta>\n'
+                f'<dc:identifier id="id">{escape(self.identifier)}</dc:identifier>\n'
+                f'<dc:title>{escape(self.title)}</dc:title>\n'
+                f'<dc:language>{escape(self.language)}</dc:language>\n'
+                f'<dc:creator id="creator">{escape(self.author)}</dc:creator>\n'
+            ).encode('utf-8'))
+            if self.source_url:
+                f.write(f'<dc:source>{escape(self.source_url)}</dc:source>\n'.encode('utf-8'))
+            if self.cover_id:
+                f.write(f'<meta name="cover" content="{self.cover_id}"/>\n'.encode('utf-8'))
+            f.write(b'</metadata>\n<manifest>\n')
+            for uid, href, media_type, properties in self.manifest:
+                props = f' properties="{properties}"' if properties else ''
+                f.write(f'<item href={quoteattr(href)} id="{uid}" media-type="{media_type}"{props}/>\n'.encode('utf-8'))
+            f.write(b'</manifest>\n<spine toc="ncx">\n')
+            if self.cover_id:
+                f.write(b'<itemref idref="cover" linear="no"/>\n')
+            f.write(b'<itemref idref="nav"/>\n')
+            for uid, _, _ in self.chapters:
+                f.write(f'<itemref idref="{uid}"/>\n'.encode('utf-8'))
+            f.write(b'</spine>\n</package>\n')
+
+
+class EpubReader:
+    """
+    Minimal random-access reader for ePubs: parses the package document and
+    reads individual files on demand, without loading the whole book.
+    `source` can be a path or a readable binary file object.
+    """
+
+    def __init__(self, source):
+        self.zip = zipfile.ZipFile(source)
+        container = ElementTree.fromstring(self.zip.read('META-INF/container.xml'))
+        self.opf_path = container.find(f'{CONTAINER_NS}rootfiles/{CONTAINER_NS}rootfile').get('full-path')
+        self.root = posixpath.dirname(self.opf_path)
+        self.opf = ElementTree.fromstring(self.zip.read(self.opf_path))
+
+    def read(self, href):
+        """
+        Returns the bytes of a file referenced relative to the package document, or None.
+        """
+        try:
+            return self.zip.read(posixpath.join(self.root, href))
+        except KeyError:
+            return None
+
+    def identifier(self):
+        unique_id = self.opf.get('unique-identifier')
+        for node in self.opf.iter(f'{DC_NS}identifier'):
+            if not unique_id or node.get('id') == unique_id:
+                return (node.text or '').strip()
+        return None
+
+    def items(self):
+        """
+        Returns the [(id, href, media_type)] entries of the manifest.
+        """
+        manifest = self.opf.find(f'{OPF_NS}manifest')
+        return [(item.get('id'), item.get('href'), item.get('media-type')) for item in manifest.iter(f'{OPF_NS}item')]
+
+    def toc(self):
+        """
+        Returns the flattened [(title, href)] entries of the NCX table of contents.
+        """
+        manifest = self.opf.find(f'{OPF_NS}manifest')
+        ncx_href = None
+        for item in manifest.iter(f'{OPF_NS}item'):
+            if item.get('media-type') == 'application/x-dtbncx+xml':
+                ncx_href = item.get('href')
+                break
+        data = self.read(ncx_href) if ncx_href else None
+        if not data:
+            return []
+        entries = []
+        for point in ElementTree.fromstring(data).iter(f'{NCX_NS}navPoint'):
+            text = point.find(f'{NCX_NS}navLabel/{NCX_NS}text')
+            content = point.find(f'{NCX_NS}content')
+            if content is not None:
+                entries.append(((text.text or '').strip() if text is not None else '', content.get('src')))
+        return entries
+
+    def close(self):
+        self.zip.close()
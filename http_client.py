@@ -0,0 +1,251 @@
+import time
+import random
+import threading
+from urllib.parse import urlparse
+
+import metrics
+from politeness import HostController
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+# Connection pool per host; should be at least the number of concurrent downloads
+DEFAULT_POOL_SIZE = 32
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+# Requests in flight towards one host, over every download of the process (all users of the app)
+DEFAULT_MAX_PER_HOST = 8
+
+# Retry policy: exponential backoff with full jitter, Retry-After wins when the server sends it
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Bodies are read in chunks and cut off past this size, so one bloated page can't eat the memory of every worker
+DEFAULT_MAX_BODY_BYTES = 10 * 1024 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+# After an early stop, a rest of the body up to this size is still read (and thrown away), so
+# the keep-alive connection goes back to the pool; a longer tail is cut off by closing the connection
+DEFAULT_MAX_DRAIN_BYTES = 512 * 1024
+
+settings = {
+    'pool_size': DEFAULT_POOL_SIZE,
+    'connect_timeout': DEFAULT_CONNECT_TIMEOUT,
+    'read_timeout': DEFAULT_READ_TIMEOUT,
+    'retries': DEFAULT_RETRIES,
+    'backoff': DEFAULT_BACKOFF,
+    'max_per_host': DEFAULT_MAX_PER_HOST,
+    'max_body_bytes': DEFAULT_MAX_BODY_BYTES,
+    'max_drain_bytes': DEFAULT_MAX_DRAIN_BYTES,
+}
+
+_session = None
+_session_lock = threading.Lock()
+_host_controllers = {}
+
+def configure(**kwargs):
+    """
+    Changes the client settings (pool_size, connect_timeout, read_timeout, retries, backoff, max_per_host,
+    max_body_bytes, max_drain_bytes).
+    A new pool size takes effect by recreating the shared session.
+    """
+    global _session
+    unknown = set(kwargs) - set(settings)
+    if unknown:
+        raise TypeError(f"Unknown HTTP client settings: {', '.join(sorted(unknown))}")
+    with _session_lock:
+        if 'pool_size' in kwargs and kwargs['pool_size'] != settings['pool_size'] and _session is not None:
+            _session.close()
+            _session = None
+        settings.update((k, v) for k, v in kwargs.items() if v is not None)
+
+def get_session():
+    """
+    Returns the process-wide requests.Session, so index, chapter and cover fetches
+    reuse keep-alive connections instead of opening a new one per request.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            # requests (and urllib3) are only loaded once something is actually downloaded
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            # Retries are handled in fetch(), so that they also go through the rate limiter
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=settings['pool_size'], max_retries=0)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update(DEFAULT_HEADERS)
+            _session = session
+        return _session
+
+def host_controller(url):
+    """
+    Returns the HostController pacing the requests towards the host of `url`,
+    shared by every download of the process (see politeness.py).
+    """
+    host = urlparse(url).netloc.lower()
+    with _session_lock:
+        controller = _host_controllers.get(host)
+        if controller is None:
+            controller = HostController(settings['max_per_host'])
+            _host_controllers[host] = controller
+        elif controller.max_limit != max(1, int(settings['max_per_host'])):
+            controller.set_max_limit(settings['max_per_host'])
+    return controller
+
+def host_states():
+    """
+    Returns {host: controller state}, for monitoring.
+    """
+    with _session_lock:
+        controllers = dict(_host_controllers)
+    return {host: controller.state() for host, controller in controllers.items()}
+
+def parse_retry_after(value):
+    """
+    Returns the delay in seconds requested by a Retry-After header (seconds or HTTP date), or None.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt):
+    # Full jitter: uniform between 0 and the exponential cap
+    return random.uniform(0, min(MAX_BACKOFF, settings['backoff'] * (2 ** attempt)))
+
+def remaining_bytes(response):
+    # Bytes of the body not read from the connection yet, or None without a Content-Length
+    try:
+        return int(response.headers['Content-Length']) - response.raw.tell()
+    except (KeyError, ValueError, TypeError, AttributeError):
+        return None
+
+def drain(response, chunks, max_bytes):
+    """
+    Reads the rest of `chunks` (the body iterator of `response`) into the void, unless it is
+    longer than `max_bytes`, and returns how much was read. Returns None and closes the
+    response, dropping its connection, if the rest was too long or could not be read.
+    """
+    remaining = remaining_bytes(response)
+    if remaining is None or remaining <= max_bytes:
+        drained = 0
+        try:
+            for chunk in chunks:
+                drained += len(chunk)
+                if drained > max_bytes:
+                    break
+            else:
+                return drained
+        except Exception:
+            pass
+    response.close()
+    metrics.count('http_connections_dropped_total')
+    return None
+
+def read_body(response, max_bytes=None, stop=None):
+    """
+    Reads the body of a response opened with stream=True, chunk by chunk, and makes
+    it available as response.content as usual. Reading ends early when `stop(chunk)`
+    returns True (e.g. once the part of the page we need has been seen) or when the
+    body reaches `max_bytes`; response.truncated tells the latter happened.
+    After an early stop, a short rest of the body is drained so the connection can be
+    reused; a long one is never downloaded: the connection is dropped instead.
+    """
+    chunks = response.iter_content(READ_CHUNK_SIZE)
+    content = []
+    size = 0
+    stopped = False
+    response.truncated = False
+    for chunk in chunks:
+        if max_bytes is not None and size + len(chunk) > max_bytes:
+            content.append(chunk[:max_bytes - size])
+            size = max_bytes
+            response.truncated = stopped = True
+            metrics.count('http_reads_stopped_total', reason='max_bytes')
+            break
+        content.append(chunk)
+        size += len(chunk)
+        if stop is not None and stop(chunk):
+            stopped = True
+            metrics.count('http_reads_stopped_total', reason='complete')
+            break
+    if stopped:
+        size += drain(response, chunks, settings['max_drain_bytes']) or 0
+    metrics.count('http_bytes_total', size)
+    # What response.content would have read in one go
+    response._content = b''.join(content)
+    response._content_consumed = True
+    return response._content
+
+def fetch(url, headers=None, timeout=None, retries=None, rate_limiter=None, max_bytes=None, make_stop=None, **kwargs):
+    """
+    GETs `url` through the shared session.
+    Connection errors, timeouts and 429/5xx responses are retried with exponential
+    backoff and jitter, waiting for Retry-After when the server sends it. Every attempt
+    first takes a token from `rate_limiter` if one is given, then waits for the host's
+    controller to allow one more request in flight. The outcome of every attempt is
+    fed back to the controller, which slows the rate and concurrency down on congestion
+    and speeds them back up while the server is healthy (see politeness.py).
+    The body is streamed in with read_body: at most `max_bytes` of it (default: the
+    max_body_bytes setting), and only until `stop(chunk)` says the rest isn't needed, where
+    `make_stop()` returns a new stop callback for every attempt (or None).
+    Returns the last response, whatever its status; raises if the last attempt failed
+    to connect or timed out.
+    """
+    import requests
+    session = get_session()
+    if timeout is None:
+        timeout = (settings['connect_timeout'], settings['read_timeout'])
+    if retries is None:
+        retries = settings['retries']
+    if max_bytes is None:
+        max_bytes = settings['max_body_bytes']
+
+    controller = host_controller(url)
+    for attempt in range(retries + 1):
+        if attempt:
+            metrics.count('http_retries_total')
+        with metrics.timed('throttle'):
+            if rate_limiter:
+                rate_limiter.acquire(controller.rate_factor)
+            controller.acquire()
+        started = time.monotonic()
+        try:
+            with metrics.timed('network'):
+                response = session.get(url, headers=headers, timeout=timeout, stream=True, **kwargs)
+                final = response.status_code not in RETRY_STATUSES or attempt == retries
+                if final:
+                    # Every attempt reads a page from its start: stateful callbacks can't be reused
+                    read_body(response, max_bytes, make_stop and make_stop())
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            controller.record(error=True)
+            metrics.count('http_errors_total', kind='timeout' if isinstance(e, requests.Timeout) else 'connection')
+            if attempt == retries:
+                raise
+            delay = backoff_delay(attempt)
+        else:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                retry_after = min(retry_after, MAX_BACKOFF)
+            controller.record(time.monotonic() - started, response.status_code, retry_after=retry_after)
+            metrics.count('http_requests_total', status=response.status_code)
+            if final:
+                return response
+            # The controller already holds every request to the host for Retry-After
+            delay = 0 if retry_after is not None else backoff_delay(attempt)
+            response.close()
+        finally:
+            controller.release()
+        if delay:
+            with metrics.timed('backoff'):
+                time.sleep(delay)
@@ -0,0 +1,243 @@
+import re
+import sys
+import hashlib
+import posixpath
+from io import BytesIO
+from importlib.util import find_spec
+from html import unescape
+from collections import deque
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from http_client import fetch
+from epub_writer import quoteattr
+from scraper import DEFAULT_MAX_WORKERS, DEFAULT_REQUESTS_PER_SECOND, get_rate_limiter
+
+# Optional: without Pillow images are embedded as downloaded. Imported on the first recompression.
+HAS_PIL = find_spec('PIL') is not None
+
+# Where embedded images go, relative to the chapter documents
+IMAGE_DIR = 'images'
+DEFAULT_MAX_SIZE = 1200  # Longest side in pixels
+DEFAULT_QUALITY = 80  # JPEG quality
+COVER_MAX_SIZE = 1600
+MAX_IMAGE_BYTES = 20 * 1024 * 1024  # Larger downloads are not embedded
+# Chapters whose images are being fetched ahead of the one being written
+IMAGE_WINDOW = 8
+
+IMG_TAG_RE = re.compile(r'<img\b[^>]*>', re.I)
+ATTR_RE = re.compile(r'([\w:-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+# Lazy-loading sites keep the real URL in a data attribute and a placeholder in src
+SRC_ATTRS = ('data-src', 'data-lazy-src', 'data-original', 'src')
+
+# Formats ePub readers have to support: format -> (media type, extension)
+IMAGE_TYPES = {
+    'JPEG': ('image/jpeg', 'jpg'),
+    'PNG': ('image/png', 'png'),
+    'GIF': ('image/gif', 'gif'),
+    'WEBP': ('image/webp', 'webp'),
+    'SVG': ('image/svg+xml', 'svg'),
+}
+
+def sniff_format(data):
+    """
+    Tells the image format from its first bytes, or None if it is not one we can embed.
+    """
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'GIF'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'WEBP'
+    if b'<svg' in data[:1024]:
+        return 'SVG'
+    return None
+
+def recompress(data, max_size=DEFAULT_MAX_SIZE, quality=DEFAULT_QUALITY):
+    """
+    Downscales an image to `max_size` pixels on its longest side and re-encodes it
+    (PNG if it has transparency, JPEG otherwise). Returns (data, format).
+    The original is kept when Pillow is missing, for SVGs and animations, and
+    when re-encoding a small enough image would not make it any lighter.
+    """
+    fmt = sniff_format(data)
+    if not HAS_PIL or fmt in (None, 'SVG'):
+        return data, fmt
+    from PIL import Image
+    try:
+        with Image.open(BytesIO(data)) as img:
+            if getattr(img, 'is_animated', False):
+                return data, fmt
+            resized = max(img.size) > max_size
+            if resized:
+                img.thumbnail((max_size, max_size), Image.LANCZOS)
+            output = BytesIO()
+            if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+                img.save(output, 'PNG', optimize=True)
+                new_fmt = 'PNG'
+            else:
+                img.convert('RGB').save(output, 'JPEG', quality=quality, optimize=True, progressive=True)
+                new_fmt = 'JPEG'
+    except Exception as e:
+        print(f"Could not recompress image: {e}", file=sys.stderr)
+        return data, fmt
+    if not resized and output.tell() >= len(data):
+        return data, fmt
+    return output.getvalue(), new_fmt
+
+def fetch_image(url, rate_limiter=None, cache=None):
+    """
+    Downloads the image at `url` and returns its bytes, or None (with a warning) if the
+    server has no usable copy: an error status, or more than MAX_IMAGE_BYTES.
+    If a ChapterCache is given, fresh copies are served without any request and stale
+    ones are revalidated with ETag/Last-Modified, like chapters.
+    Raises on network errors.
+    """
+    headers = {}
+    cached = cache.get_image(url) if cache else None
+    if cached:
+        if cache.is_fresh(cached):
+            metrics.count('images_total', source='cache')
+            return cached['data']
+        headers.update(cache.validation_headers(cached))
+
+    # Never more than MAX_IMAGE_BYTES in memory, however big the file is
+    response = fetch(url, headers=headers, rate_limiter=rate_limiter, max_bytes=MAX_IMAGE_BYTES)
+    if cached and response.status_code == 304:
+        cache.touch(url, 'images')
+        metrics.count('images_total', source='revalidated')
+        return cached['data']
+    if response.status_code != 200 or response.truncated:
+        print(f"Skipping image {url} (status {response.status_code}, {'over ' if response.truncated else ''}{len(response.content)} bytes)", file=sys.stderr)
+        return None
+    metrics.count('images_total', source='network')
+    if cache:
+        cache.put_image(url, response.content,
+                        etag=response.headers.get('ETag'),
+                        last_modified=response.headers.get('Last-Modified'))
+    return response.content
+
+def image_source(tag):
+    attributes = {m.group(1).lower(): m.group(2) if m.group(2) is not None else m.group(3) for m in ATTR_RE.finditer(tag)}
+    for name in SRC_ATTRS:
+        value = attributes.get(name)
+        if value and not value.startswith('data:'):
+            return unescape(value), attributes
+    return None, attributes
+
+def copy_images(reader, writer):
+    """
+    Update mode: copies the images embedded in an existing book.
+    Returns their file names, so they are not embedded a second time.
+    """
+    copied = set()
+    for uid, href, media_type in reader.items():
+        if href.startswith(IMAGE_DIR + '/'):
+            data = reader.read(href)
+            if data is not None:
+                writer.add_item(uid, href, data, media_type=media_type)
+                copied.add(href)
+    return copied
+
+class ImagePipeline:
+    """
+    Embeds the images of the chapters into the book being written.
+    Image downloads (and their recompression) run in a thread pool, a few
+    chapters ahead of the one being written; every URL is fetched once, and
+    identical images found at different URLs are stored once, by content hash.
+    With a ChapterCache, downloaded images are cached along with the chapters.
+    """
+
+    def __init__(self, writer, max_workers=DEFAULT_MAX_WORKERS, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                 max_size=DEFAULT_MAX_SIZE, quality=DEFAULT_QUALITY, existing=(), cache=None):
+        self.writer = writer
+        self.max_workers = max(1, int(max_workers))
+        self.requests_per_second = requests_per_second
+        self.cache = cache
+        self.max_size = max_size
+        self.quality = quality
+        self.pending = {}  # url -> future
+        self.url_hrefs = {}  # url -> file name in the book, None if it couldn't be embedded
+        # File names are derived from the content hash, so existing images are recognized by name
+        self.hash_hrefs = {posixpath.splitext(posixpath.basename(href))[0]: href for href in existing}
+
+    def _download(self, url):
+        try:
+            content = fetch_image(url, get_rate_limiter(url, self.requests_per_second), self.cache)
+        except Exception as e:
+            print(f"Error downloading image {url}: {e}", file=sys.stderr)
+            return None
+        if content is None:
+            return None
+        digest = hashlib.sha1(content).hexdigest()[:20]
+        if digest in self.hash_hrefs:
+            return digest, None, None
+        with metrics.timed('recompress'):
+            data, fmt = recompress(content, self.max_size, self.quality)
+        if fmt is None:
+            print(f"Skipping image {url}: unsupported format", file=sys.stderr)
+            return None
+        return digest, data, fmt
+
+    def _submit(self, executor, content, base_url):
+        if '<img' not in content:
+            return
+        for tag in IMG_TAG_RE.findall(content):
+            src, _ = image_source(tag)
+            if not src:
+                continue
+            url = urljoin(base_url, src)
+            if url.startswith(('http://', 'https://')) and url not in self.url_hrefs and url not in self.pending:
+                self.pending[url] = executor.submit(self._download, url)
+
+    def _store(self, result):
+        # Runs in the writing thread only: the ePub writer isn't thread-safe
+        if result is None:
+            return None
+        digest, data, fmt = result
+        href = self.hash_hrefs.get(digest)
+        if href is None:
+            media_type, extension = IMAGE_TYPES[fmt]
+            href = f'{IMAGE_DIR}/{digest}.{extension}'
+            self.writer.add_item(f'img_{digest}', href, data, media_type=media_type)
+            self.hash_hrefs[digest] = href
+        return href
+
+    def _rewrite(self, content, base_url):
+        if '<img' not in content:
+            return content
+
+        def replace(match):
+            src, attributes = image_source(match.group(0))
+            if not src:
+                return match.group(0)
+            url = urljoin(base_url, src)
+            if url in self.pending:
+                self.url_hrefs[url] = self._store(self.pending.pop(url).result())
+            href = self.url_hrefs.get(url)
+            if href is None:
+                return match.group(0)
+            alt = unescape(attributes.get('alt') or '')
+            return f'<img src={quoteattr(href)} alt={quoteattr(alt)}/>'
+
+        return IMG_TAG_RE.sub(replace, content)
+
+    def inline(self, chapters):
+        """
+        Takes (chapter_info, content) pairs and yields them back, in order,
+        with their images embedded and pointing to the copies in the book.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            window = deque()
+            for chapter_info, content in chapters:
+                self._submit(executor, content, chapter_info['URL'])
+                window.append((chapter_info, content))
+                if len(window) > IMAGE_WINDOW:
+                    chapter_info, content = window.popleft()
+                    yield chapter_info, self._rewrite(content, chapter_info['URL'])
+            while window:
+                chapter_info, content = window.popleft()
+                yield chapter_info, self._rewrite(content, chapter_info['URL'])
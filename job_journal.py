@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+from chapter_cache import CACHE_DIR
+
+JOBS_DIR = os.path.join(CACHE_DIR, 'jobs')
+JOURNAL_MAX_AGE = 7 * 24 * 3600  # Abandoned journals are pruned after a week
+
+# Journals opened with open_for, by path: jobs for the same chapters share one
+_journals = {}
+_journals_lock = threading.Lock()
+
+def job_id(source_url, chapters_data):
+    """
+    Identifies a download job by its novel and the exact list of chapters it covers,
+    so starting the same novel and range again finds the same journal.
+    """
+    digest = hashlib.sha1((source_url or '').encode('utf-8'))
+    for chapter_info in chapters_data:
+        digest.update(b'\n' + chapter_info['URL'].encode('utf-8'))
+    return digest.hexdigest()[:20]
+
+class JobJournal:
+    """
+    Append-only checkpoint file for a download job. Every chapter that finishes is
+    written out immediately as one JSON line with its position, URL, status and
+    cleaned content. Reopening the journal of an interrupted job tells which
+    chapters are already done; their content is read back from disk on demand,
+    so only the offsets are kept in memory.
+    Two jobs for the same novel and range (a double-clicked button, two users) get the
+    same journal from open_for: each of them releases it with close() or discard(),
+    and the file is only closed, and deleted if discarded, by the last one.
+    Used as a context manager, the journal is discarded if the block succeeds and
+    kept for a later resume otherwise.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.users = 1
+        self.lock = threading.Lock()
+        self.offsets = {}  # chapter index -> (url, byte offset of its record)
+        self._load()
+        self.file = open(path, 'ab')
+
+    @classmethod
+    def open_for(cls, source_url, chapters_data, jobs_dir=None):
+        jobs_dir = jobs_dir or JOBS_DIR
+        os.makedirs(jobs_dir, exist_ok=True)
+        path = os.path.join(jobs_dir, job_id(source_url, chapters_data) + '.jsonl')
+        with _journals_lock:
+            journal = _journals.get(path)
+            if journal is not None:
+                journal.users += 1
+                return journal
+            prune_journals(jobs_dir, skip=_journals)
+            journal = _journals[path] = cls(path)
+            return journal
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        valid_end = 0
+        with open(self.path, 'rb') as f:
+            offset = 0
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Partial last line from a run that died mid-write
+                    break
+                if record.get('status') == 'done':
+                    self.offsets[record['index']] = (record['url'], offset)
+                offset += len(line)
+                valid_end = offset
+        if valid_end < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_end)
+
+    @property
+    def completed(self):
+        return len(self.offsets)
+
+    def is_done(self, index, url):
+        entry = self.offsets.get(index)
+        return entry is not None and entry[0] == url
+
+    def record(self, index, url, content, status='done'):
+        """
+        Appends one chapter's outcome. Safe to call from download threads.
+        """
+        line = json.dumps({'index': index, 'url': url, 'status': status, 'content': content,
+                           'time': round(time.time(), 3)}, ensure_ascii=False).encode('utf-8') + b'\n'
+        with self.lock:
+            offset = self.file.tell()
+            self.file.write(line)
+            self.file.flush()
+            if status == 'done':
+                self.offsets[index] = (url, offset)
+
+    def read(self, index):
+        """
+        Returns the cleaned content recorded for a finished chapter.
+        """
+        _, offset = self.offsets[index]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())['content']
+
+    def _release(self, delete):
+        with _journals_lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+            if _journals.get(self.path) is self:
+                del _journals[self.path]
+        with self.lock:
+            self.file.close()
+        if delete:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def close(self):
+        """
+        Releases the journal, keeping the file so the job can be resumed.
+        """
+        self._release(delete=False)
+
+    def discard(self):
+        """
+        Releases the journal once its job has been assembled successfully;
+        the file is deleted when no other job is using it.
+        """
+        self._release(delete=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.discard()
+        else:
+            self.close()
+
+def prune_journals(jobs_dir=None, max_age=JOURNAL_MAX_AGE, skip=()):
+    # Journals in `skip` (paths) are in use
+    jobs_dir = jobs_dir or JOBS_DIR
+    now = time.time()
+    for name in os.listdir(jobs_dir):
+        path = os.path.join(jobs_dir, name)
+        if path in skip:
+            continue
+        try:
+            if name.endswith('.jsonl') and now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except OSError:
+            pass
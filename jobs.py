@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+import metrics
+from chapter_cache import CACHE_DIR
+from epub_builder import create_epub, create_volumes, bundle_volumes, read_existing_epub
+
+# Finished exports are served from disk and pruned after a day
+EXPORT_DIR = os.path.join(CACHE_DIR, 'exports')
+EXPORT_MAX_AGE = 24 * 3600
+
+DEFAULT_JOB_WORKERS = 2  # Exports running at the same time, for all users together
+PROGRESS_INTERVAL = 0.5  # Seconds between progress writes of a running job
+# Set to a directory to dump a cProfile of every export there, as <job id>.prof
+PROFILE_DIR = os.environ.get('WNEPUB_PROFILE_DIR')
+
+def new_export_path(suffix='.epub'):
+    """
+    Returns a fresh file path for an export, pruning exports older than a day.
+    """
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    now = time.time()
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > EXPORT_MAX_AGE:
+                os.remove(path)
+        except OSError:
+            pass
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=EXPORT_DIR)
+    os.close(fd)
+    return path
+
+class JobQueue:
+    """
+    Persistent queue of export jobs, stored in SQLite next to the chapter cache.
+    A job is a JSON-able dict of parameters (see run_job) plus its status:
+    queued, running, done or failed, with its progress and result file.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, 'jobs.sqlite3')
+        self.path = path
+        self.lock = threading.Lock()
+        # One connection shared by the UI and the worker threads, serialized by self.lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' id TEXT PRIMARY KEY,'
+            ' status TEXT,'
+            ' params TEXT,'
+            ' file_name TEXT,'
+            ' created REAL,'
+            ' started REAL,'
+            ' finished REAL,'
+            ' done INTEGER,'
+            ' total INTEGER,'
+            ' message TEXT,'
+            ' result_path TEXT,'
+            ' error TEXT)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)')
+        self.conn.commit()
+
+    def _execute(self, sql, args=()):
+        with self.lock:
+            cursor = self.conn.execute(sql, args)
+            self.conn.commit()
+            return cursor
+
+    def submit(self, params, file_name):
+        """
+        Queues an export and returns its job id. `file_name` is what the result is downloaded as.
+        """
+        job_id = uuid.uuid4().hex
+        self._execute('INSERT INTO jobs (id, status, params, file_name, created, done, total) VALUES (?, ?, ?, ?, ?, 0, ?)',
+                      (job_id, 'queued', json.dumps(params), file_name, time.time(), len(params['chapters'])))
+        return job_id
+
+    def get(self, job_id):
+        """
+        Returns the job's status as a dict (without its parameters), or None.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT status, file_name, created, started, finished, done, total, message, result_path, error'
+                ' FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            ahead = 0
+            if row[0] == 'queued':
+                ahead = self.conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created < ?",
+                                          (row[2],)).fetchone()[0]
+        keys = ('status', 'file_name', 'created', 'started', 'finished', 'done', 'total', 'message', 'result_path', 'error')
+        job = dict(zip(keys, row))
+        job['id'] = job_id
+        job['ahead'] = ahead
+        return job
+
+    def claim(self):
+        """
+        Marks the oldest queued job as running and returns (job_id, params), or None if there is none.
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT id, params FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE jobs SET status = 'running', started = ? WHERE id = ?", (time.time(), row[0]))
+            self.conn.commit()
+        return row[0], json.loads(row[1])
+
+    def progress(self, job_id, done, total, message):
+        self._execute('UPDATE jobs SET done = ?, total = ?, message = ? WHERE id = ?', (done, total, message, job_id))
+
+    def finish(self, job_id, result_path):
+        self._execute("UPDATE jobs SET status = 'done', finished = ?, result_path = ? WHERE id = ?",
+                      (time.time(), result_path, job_id))
+
+    def fail(self, job_id, error):
+        self._execute("UPDATE jobs SET status = 'failed', finished = ?, error = ? WHERE id = ?",
+                      (time.time(), error, job_id))
+
+    def counts(self):
+        """
+        Returns {status: number of jobs}.
+        """
+        with self.lock:
+            return dict(self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    def requeue_interrupted(self):
+        """
+        Puts the jobs that were running when the previous process stopped back in the queue.
+        Their job journals make them pick up where they left off.
+        """
+        self._execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+
+    def prune(self, max_age=EXPORT_MAX_AGE):
+        # Results are pruned from disk after the same delay
+        self._execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?", (time.time() - max_age,))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def run_job(params, progress_callback=None, cache=None):
+    """
+    Runs one export and returns the path of the result (an ePub, or a zip of volumes).
+    `params` holds book_title, title, author, chapters, cover_url, start_idx, use_cache,
+    the create_epub keyword `options`, and optionally `split` (create_volumes keywords)
+    or `base_path` (an ePub to update).
+    """
+    options = dict(params['options'])
+    options['cache'] = cache if params.get('use_cache') else None
+
+    if params.get('split'):
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        volumes_dir = tempfile.mkdtemp(dir=EXPORT_DIR)
+        try:
+            volumes = create_volumes(params['title'], params['author'], params['chapters'], volumes_dir,
+                                     progress_callback, params['cover_url'], start_idx=params['start_idx'],
+                                     **params['split'], **options)
+            return bundle_volumes([path for _, path in volumes], new_export_path('.zip'))
+        finally:
+            shutil.rmtree(volumes_dir, ignore_errors=True)
+
+    base = read_existing_epub(params['base_path']) if params.get('base_path') else None
+    try:
+        result_path = create_epub(params['book_title'], params['author'], params['chapters'], progress_callback,
+                                  params['cover_url'], base=base, output_path=new_export_path(), **options)
+    finally:
+        if base:
+            base['reader'].close()
+    # The uploaded ePub is only needed until the update succeeds; after a failure it stays
+    # (like the job journal) until exports older than a day are pruned
+    if base:
+        os.remove(params['base_path'])
+    return result_path
+
+class JobWorkers:
+    """
+    Background threads taking jobs off a JobQueue and running them, so exports
+    don't depend on the Streamlit script run (or browser tab) that started them.
+    """
+
+    def __init__(self, queue, workers=DEFAULT_JOB_WORKERS, cache=None):
+        self.queue = queue
+        self.cache = cache
+        self.wakeup = threading.Event()
+        queue.requeue_interrupted()
+        queue.prune()
+        metrics.register_gauge('jobs_queued', lambda: queue.counts().get('queued', 0))
+        metrics.register_gauge('jobs_running', lambda: queue.counts().get('running', 0))
+        self.threads = [threading.Thread(target=self._loop, name=f'export-worker-{i}', daemon=True) for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def notify(self):
+        # Called after submitting, so an idle worker starts right away instead of at its next poll
+        self.wakeup.set()
+
+    def _loop(self):
+        while True:
+            claimed = self.queue.claim()
+            if claimed is None:
+                self.wakeup.wait(1.0)
+                self.wakeup.clear()
+                continue
+            self.run(*claimed)
+
+    def run(self, job_id, params):
+        last_write = 0.0
+
+        def report_progress(done, total, chap_title):
+            nonlocal last_write
+            now = time.monotonic()
+            if done == total or now - last_write >= PROGRESS_INTERVAL:
+                last_write = now
+                self.queue.progress(job_id, done, total, chap_title)
+
+        started = time.monotonic()
+        try:
+            if PROFILE_DIR:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                with metrics.profiled(os.path.join(PROFILE_DIR, f'{job_id}.prof')):
+                    result_path = run_job(params, report_progress, self.cache)
+            else:
+                result_path = run_job(params, report_progress, self.cache)
+        except Exception as e:
+            print(f"Export {job_id} failed: {e}", file=sys.stderr)
+            metrics.count('jobs_total', status='failed')
+            self.queue.fail(job_id, str(e))
+            return
+        metrics.count('jobs_total', status='done')
+        metrics.observe('job_seconds', time.monotonic() - started)
+        self.queue.finish(job_id, result_path)
@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Process-wide metrics, shared by every download, job and session.
+# Series are keyed by (name, sorted label pairs).
+_lock = threading.Lock()
+_counters = {}
+_timings = {}  # -> [count, total seconds, max seconds]
+_gauges = {}
+_gauge_callbacks = {}  # name -> function returning the current value
+started_at = time.time()
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def count(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        timing = _timings.get(key)
+        if timing is None:
+            _timings[key] = [1, seconds, seconds]
+        else:
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+def add_gauge(name, delta, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + delta
+
+def register_gauge(name, callback):
+    """
+    Reports `name` with the value returned by `callback` whenever metrics are read
+    (e.g. the length of a queue that lives in a database).
+    """
+    with _lock:
+        _gauge_callbacks[name] = callback
+
+@contextmanager
+def timed(stage):
+    """
+    Adds the time spent in the block to stage_seconds{stage=...}.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe('stage_seconds', time.perf_counter() - start, stage=stage)
+
+def reset():
+    global started_at
+    with _lock:
+        _counters.clear()
+        _timings.clear()
+        _gauges.clear()
+        started_at = time.time()
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+def snapshot():
+    """
+    Returns every metric as a JSON-able dict, with Prometheus-style series names as keys.
+    """
+    with _lock:
+        counters = dict(_counters)
+        timings = {key: list(value) for key, value in _timings.items()}
+        gauges = dict(_gauges)
+        callbacks = dict(_gauge_callbacks)
+    for name, callback in callbacks.items():
+        try:
+            gauges[(name, ())] = callback()
+        except Exception as e:
+            print(f"Could not read gauge {name}: {e}", file=sys.stderr)
+    return {
+        'uptime_seconds': round(time.time() - started_at, 3),
+        'counters': {_series(*key): value for key, value in sorted(counters.items())},
+        'timings': {_series(*key): {'count': c, 'sum': round(total, 6), 'max': round(peak, 6)}
+                    for key, (c, total, peak) in sorted(timings.items())},
+        'gauges': {_series(*key): value for key, value in sorted(gauges.items())},
+    }
+
+def stage_seconds():
+    """
+    Returns {stage: total seconds} from the stage_seconds timings.
+    """
+    with _lock:
+        return {dict(labels)['stage']: total for (name, labels), (_, total, _) in _timings.items()
+                if name == 'stage_seconds'}
+
+def to_prometheus():
+    """
+    Renders the metrics in the Prometheus text exposition format.
+    """
+    data = snapshot()
+    lines = ['# TYPE wnepub_uptime_seconds gauge', f"wnepub_uptime_seconds {data['uptime_seconds']}"]
+    declared = set()
+
+    def declare(series, kind):
+        name = 'wnepub_' + series.split('{')[0]
+        if name not in declared:
+            declared.add(name)
+            lines.append(f'# TYPE {name} {kind}')
+        return 'wnepub_' + series
+
+    for series, value in data['counters'].items():
+        lines.append(f'{declare(series, "counter")} {value}')
+    for series, timing in data['timings'].items():
+        name, _, labels = series.partition('{')
+        declare(name, 'summary')
+        labels = '{' + labels if labels else ''
+        lines.append(f"wnepub_{name}_count{labels} {timing['count']}")
+        lines.append(f"wnepub_{name}_sum{labels} {timing['sum']}")
+    for series, value in data['gauges'].items():
+        lines.append(f'{declare(series, "gauge")} {value}')
+    return '\n'.join(lines) + '\n'
+
+def write_metrics(path):
+    """
+    Writes the metrics to `path`: Prometheus text for .prom files, JSON otherwise.
+    The file is replaced atomically, so collectors never read half of it.
+    """
+    content = to_prometheus() if path.endswith('.prom') else json.dumps(snapshot(), indent=2)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def start_metrics_writer(path, interval=10.0):
+    """
+    Rewrites the metrics file every `interval` seconds from a background thread.
+    """
+    def loop():
+        while True:
+            try:
+                write_metrics(path)
+            except OSError as e:
+                print(f"Could not write metrics to {path}: {e}", file=sys.stderr)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name='metrics-writer', daemon=True)
+    thread.start()
+    return thread
+
+def serve_metrics(port, host='127.0.0.1'):
+    """
+    Serves /metrics (Prometheus text) and /metrics.json from a background thread.
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = to_prometheus(), 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body, content_type = json.dumps(snapshot(), indent=2), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            body = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+def configure_from_env():
+    """
+    Starts the metrics endpoint (WNEPUB_METRICS_PORT) and/or file (WNEPUB_METRICS_FILE) if requested.
+    """
+    if os.environ.get('WNEPUB_METRICS_PORT'):
+        serve_metrics(int(os.environ['WNEPUB_METRICS_PORT']))
+    if os.environ.get('WNEPUB_METRICS_FILE'):
+        start_metrics_writer(os.environ['WNEPUB_METRICS_FILE'])
+
+_profile_lock = threading.Lock()
+
+@contextmanager
+def profiled(path):
+    """
+    Profiles the block with cProfile, including the threads it starts (download
+    and image pools), and dumps the merged stats to `path` for pstats/snakeviz.
+    Only one block is profiled at a time; a nested or concurrent one runs unprofiled.
+    """
+    import pstats
+    import cProfile
+
+    if not _profile_lock.acquire(blocking=False):
+        yield
+        return
+    thread_profiles = []
+
+    def start_thread_profile(frame, event, arg):
+        # First event of a new thread: hand the thread over to its own profiler
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+: the main profiler already sees every thread
+            return
+        thread_profiles.append(profile)
+
+    main_profile = cProfile.Profile()
+    main_profile.enable()
+    threading.setprofile(start_thread_profile)
+    try:
+        yield
+    finally:
+        threading.setprofile(None)
+        main_profile.disable()
+        stats = pstats.Stats(main_profile)
+        for profile in thread_profiles:
+            stats.add(profile)
+        stats.dump_stats(path)
+        _profile_lock.release()
@@ -0,0 +1,139 @@
+import os
+import re
+import codecs
+from html.parser import HTMLParser
+from importlib.util import find_spec
+
+# Optional faster backends: lxml as BeautifulSoup tree builder, selectolax (lexbor)
+# to locate a container in the raw page before building a tree for it.
+# Only looked up here: BeautifulSoup and the backends are imported when the first page is parsed.
+HAS_LXML = find_spec('lxml') is not None
+HAS_SELECTOLAX = find_spec('selectolax') is not None
+
+_selectolax_parser = None
+
+def _selectolax():
+    global _selectolax_parser
+    if _selectolax_parser is None:
+        try:
+            from selectolax.lexbor import LexborHTMLParser as parser
+        except ImportError:
+            from selectolax.parser import HTMLParser as parser
+        _selectolax_parser = parser
+    return _selectolax_parser
+
+BACKENDS = ('selectolax', 'lxml', 'html.parser')
+
+def available_backends():
+    backends = []
+    if HAS_SELECTOLAX:
+        backends.append('selectolax')
+    if HAS_LXML:
+        backends.append('lxml')
+    backends.append('html.parser')
+    return backends
+
+def _default_backend():
+    requested = os.environ.get('WNEPUB_PARSER')
+    if requested in available_backends():
+        return requested
+    return available_backends()[0]
+
+_backend = _default_backend()
+
+def get_backend():
+    return _backend
+
+def set_backend(name):
+    """
+    Selects the parser backend ('selectolax', 'lxml' or 'html.parser').
+    The default is the fastest one installed, or the WNEPUB_PARSER environment variable.
+    """
+    global _backend
+    if name not in available_backends():
+        raise ValueError(f"Parser backend {name!r} is not available (installed: {', '.join(available_backends())})")
+    _backend = name
+
+def _tree_builder(backend):
+    # selectolax only locates fragments; the tree handed to the cleaning code is always BeautifulSoup
+    return 'lxml' if backend != 'html.parser' and HAS_LXML else 'html.parser'
+
+def make_soup(markup, backend=None):
+    """
+    Parses a whole page into a BeautifulSoup tree with the fastest available tree builder.
+    """
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(markup, _tree_builder(backend or _backend))
+
+def parse_scoped(markup, element_id, backend=None):
+    """
+    Builds a tree for the element with the given id only, skipping the rest of the page.
+    Returns a BeautifulSoup document holding just that element, or None if the page doesn't contain it.
+    """
+    from bs4 import BeautifulSoup, SoupStrainer
+    backend = backend or _backend
+    if backend == 'selectolax':
+        node = _selectolax()(markup).css_first(f'[id="{element_id}"]')
+        if node is None:
+            return None
+        return BeautifulSoup(node.html, _tree_builder(backend))
+
+    soup = BeautifulSoup(markup, _tree_builder(backend), parse_only=SoupStrainer(id=element_id))
+    return soup if soup.find(id=element_id) else None
+
+# Elements that never have a closing tag
+VOID_TAGS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+                       'param', 'source', 'track', 'wbr'])
+
+class _ScopeParser(HTMLParser):
+    # Keeps the stack of elements open inside the watched one
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.open_tags = []
+        self.closed = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        if self.closed or tag not in self.open_tags:
+            return
+        # Also closes the elements opened after it and left unclosed (like <p> without </p>)
+        del self.open_tags[len(self.open_tags) - 1 - self.open_tags[::-1].index(tag):]
+        if not self.open_tags:
+            self.closed = True
+
+class ScopeWatcher:
+    """
+    Follows a page while it is downloaded and tells when the element with the given
+    id is complete, so the rest of the page (comment sections, footers) needn't be read.
+    The raw bytes are only searched for the element's opening tag; from there on they
+    are fed to the standard library's incremental HTMLParser, which keeps track of the
+    nesting (scripts and comments included) until the element is closed.
+    Pass feed as the `stop` callback of http_client.fetch.
+    """
+
+    def __init__(self, element_id):
+        # The attribute name must be exactly "id": \b alone would also match data-id or v-bind:id
+        self.start_re = re.compile(rb'<[a-zA-Z][^>]*(?<![\w:.-])id\s*=\s*["\']?' + re.escape(element_id.encode()) + rb'["\'\s/>]', re.I)
+        self.buffer = b''  # Bytes before the element, kept until its opening tag is found
+        self.parser = None
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def feed(self, chunk):
+        """
+        Takes the next chunk of the page; returns True once the element has been closed.
+        """
+        if self.parser is None:
+            self.buffer += chunk
+            match = self.start_re.search(self.buffer)
+            if match is None:
+                # Keep just enough to find an opening tag split between two chunks
+                self.buffer = self.buffer[-1024:]
+                return False
+            chunk = self.buffer[match.start():]
+            self.buffer = b''
+            self.parser = _ScopeParser()
+        self.parser.feed(self.decoder.decode(chunk))
+        return self.parser.closed
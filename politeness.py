@@ -0,0 +1,106 @@
+import time
+import threading
+
+import metrics
+
+# AIMD tuning: back off hard on congestion, recover a little with every healthy response
+MIN_RATE_FACTOR = 0.05  # Slowest pace, as a fraction of the configured requests per second
+RATE_INCREASE = 0.02  # Added to the rate factor per healthy response
+DECREASE_FACTOR = 0.5  # Rate factor and concurrency are multiplied by this on congestion
+SLOW_DECREASE_FACTOR = 0.8  # Gentler, for responses getting slower
+DECREASE_COOLDOWN = 2.0  # Seconds: the requests in flight when the server choked report the same congestion
+CONGESTION_STATUSES = {429, 503, 504}
+# A response is "slow" when the latency average exceeds both of these, relative to the best one seen
+SLOW_FACTOR = 3.0
+MIN_SLOWDOWN = 0.5  # Seconds
+LATENCY_SMOOTHING = 0.2
+
+class HostController:
+    """
+    Adapts the pace of the requests towards one host to how the server copes, like
+    TCP congestion control (AIMD): every healthy response raises the request rate a
+    little and, once per window of `limit` responses, allows one more request in
+    flight; a 429/503/504, a timeout or a connection error halves both, and a
+    Retry-After pauses every request to the host, not just the one that got it.
+    Responses growing much slower than usual also slow things down, more gently.
+    The configured rate and max_limit are ceilings: the controller only backs off
+    from them and recovers up to them.
+    """
+
+    def __init__(self, max_limit):
+        self.cond = threading.Condition()
+        self.max_limit = max(1, int(max_limit))
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self.rate_factor = 1.0
+        self.window_successes = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.latency = None  # Smoothed latency
+        self.best_latency = None
+
+    def set_max_limit(self, max_limit):
+        with self.cond:
+            self.max_limit = max(1, int(max_limit))
+            self.limit = min(self.limit, self.max_limit)
+            self.cond.notify_all()
+
+    def acquire(self):
+        # Blocks while the host is paused or has `limit` requests in flight
+        with self.cond:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                self.cond.wait(wait if wait > 0 else None)
+
+    def release(self):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify()
+
+    def _decrease(self, factor, reason, now):
+        if now - self.last_decrease < DECREASE_COOLDOWN:
+            return
+        self.last_decrease = now
+        self.rate_factor = max(MIN_RATE_FACTOR, self.rate_factor * factor)
+        self.limit = max(1, int(self.limit * factor))
+        self.window_successes = 0
+        metrics.count('politeness_decreases_total', reason=reason)
+
+    def record(self, latency=None, status=None, error=False, retry_after=None):
+        """
+        Feeds the outcome of one request: its latency and status, or error=True
+        if it timed out or failed to connect, and the Retry-After delay if any.
+        """
+        now = time.monotonic()
+        with self.cond:
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            if error or status in CONGESTION_STATUSES:
+                self._decrease(DECREASE_FACTOR, 'error' if error else str(status), now)
+                return
+            if latency is not None:
+                self.latency = latency if self.latency is None else \
+                    self.latency + LATENCY_SMOOTHING * (latency - self.latency)
+                if self.best_latency is None or self.latency < self.best_latency:
+                    self.best_latency = self.latency
+                else:
+                    # Drifts up slowly, so a site that got slower for good isn't throttled forever
+                    self.best_latency += 0.01 * (self.latency - self.best_latency)
+                if self.latency > max(SLOW_FACTOR * self.best_latency, self.best_latency + MIN_SLOWDOWN):
+                    self._decrease(SLOW_DECREASE_FACTOR, 'slow', now)
+                    return
+            self.rate_factor = min(1.0, self.rate_factor + RATE_INCREASE)
+            self.window_successes += 1
+            if self.window_successes >= self.limit:
+                self.window_successes = 0
+                if self.limit < self.max_limit:
+                    self.limit += 1
+                    self.cond.notify()
+
+    def state(self):
+        with self.cond:
+            return {'rate_factor': round(self.rate_factor, 3), 'limit': self.limit, 'in_flight': self.in_flight,
+                    'latency': self.latency and round(self.latency, 3)}
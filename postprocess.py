@@ -0,0 +1,180 @@
+import os
+import sys
+import types
+import threading
+import multiprocessing
+from collections import deque
+from contextlib import contextmanager
+
+import parsers
+from boilerplate import paragraph_fingerprints
+from scraper import clean_chapter_page, record_stages
+
+# On Linux, workers are forked from a small server process started for the purpose, never
+# from the exporting process and its download threads; elsewhere they are spawned, since
+# fork is unsafe on macOS and missing on Windows
+START_METHOD = 'forkserver' if sys.platform.startswith('linux') else 'spawn'
+# Worker processes for the CPU-bound stages; 1 keeps them in the exporting process
+DEFAULT_PROCESSES = int(os.environ.get('WNEPUB_PROCESSES') or 0) or os.cpu_count() or 1
+# Chapters fingerprinted per task, and batches in flight per worker process
+FINGERPRINT_BATCH = 16
+BATCHES_PER_PROCESS = 2
+
+def clean_page(html, chapter_title, adapter, backend):
+    # Runs in a worker process: the parser backend is the exporting process's one
+    if parsers.get_backend() != backend:
+        parsers.set_backend(backend)
+    return clean_chapter_page(html, chapter_title, adapter)
+
+def fingerprint_batch(contents):
+    return [paragraph_fingerprints(content) for content in contents]
+
+@contextmanager
+def _main_script_hidden():
+    # New workers run the main script again (as __mp_main__) if __main__ has a file. For the
+    # Streamlit app, whose script is __main__, that would start a copy of the app (and its job
+    # workers) in every worker process; the workers only need this module.
+    main = sys.modules['__main__']
+    stand_in = types.ModuleType('__main__')
+    sys.modules['__main__'] = stand_in
+    try:
+        yield
+    finally:
+        if sys.modules['__main__'] is stand_in:
+            sys.modules['__main__'] = main
+
+_context = multiprocessing.get_context(START_METHOD)
+
+class _WorkerProcess(_context.Process):
+    # Hides the main script while a worker (or the fork server) is started
+    @staticmethod
+    def _Popen(process_obj):
+        with _main_script_hidden():
+            return _context.Process._Popen(process_obj)
+
+class _WorkerContext(type(_context)):
+    Process = _WorkerProcess
+
+def _worker_context():
+    context = _WorkerContext()
+    if START_METHOD == 'forkserver':
+        # Imported once in the server, so forked workers start with it loaded
+        context.set_forkserver_preload(['postprocess'])
+    return context
+
+class ChapterProcessor:
+    """
+    Runs the CPU-bound chapter stages in a pool of worker processes, so that they use
+    every core instead of taking turns under the GIL: parsing, cleaning and serializing
+    the downloaded pages (clean), and fingerprinting paragraphs for boilerplate
+    detection (fingerprints). The pool is started by start() or on first use.
+    """
+
+    def __init__(self, processes=DEFAULT_PROCESSES):
+        self.processes = max(1, int(processes))
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self.executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=_worker_context())
+            return self.executor
+
+    def start(self):
+        """
+        Starts the pool and its first worker now rather than on the first chapter.
+        """
+        self._executor().submit(os.getpid).result()
+
+    def clean(self, html, chapter_title=None, adapter=None):
+        """
+        clean_chapter_html in a worker process: blocks the calling (download) thread
+        until the content is back, then records the stage timings here.
+        """
+        from concurrent.futures.process import BrokenProcessPool
+        executor = self._executor()
+        try:
+            content, timings = executor.submit(clean_page, html, chapter_title, adapter, parsers.get_backend()).result()
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+        record_stages(timings)
+        return content
+
+    def fingerprints(self, contents):
+        """
+        Yields (content, paragraph fingerprints) for each of `contents`, in order.
+        Chapters are sent to the workers in batches, a few batches per process
+        ahead of the one being consumed, so memory stays bounded.
+        """
+        from concurrent.futures.process import BrokenProcessPool
+        executor = self._executor()
+        try:
+            yield from self._fingerprint(executor, contents)
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+
+    def _fingerprint(self, executor, contents):
+        in_flight = deque()
+        batch = []
+        for content in contents:
+            batch.append(content)
+            if len(batch) >= FINGERPRINT_BATCH:
+                in_flight.append((batch, executor.submit(fingerprint_batch, batch)))
+                batch = []
+                if len(in_flight) > self.processes * BATCHES_PER_PROCESS:
+                    done, future = in_flight.popleft()
+                    yield from zip(done, future.result())
+        if batch:
+            in_flight.append((batch, executor.submit(fingerprint_batch, batch)))
+        while in_flight:
+            done, future = in_flight.popleft()
+            yield from zip(done, future.result())
+
+    def _discard(self, executor):
+        # A worker that died (killed, out of memory) breaks the whole pool: start a new one next time
+        with self.lock:
+            if self.executor is executor:
+                executor.shutdown(wait=False)
+                self.executor = None
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+settings = {'processes': DEFAULT_PROCESSES}
+_processor = None
+_processor_lock = threading.Lock()
+
+def configure(processes=None):
+    """
+    Sets the number of worker processes (1 disables the pool).
+    A running pool of another size is shut down and replaced on next use.
+    """
+    global _processor
+    with _processor_lock:
+        if processes is not None:
+            settings['processes'] = max(1, int(processes))
+        if _processor is not None and _processor.processes != settings['processes']:
+            _processor.shutdown()
+            _processor = None
+
+def get_processor():
+    """
+    Returns the process-wide ChapterProcessor, shared by every export,
+    or None when the CPU-bound stages run in-process.
+    The first call starts the pool: make it at startup, before any export runs.
+    """
+    global _processor
+    with _processor_lock:
+        if settings['processes'] <= 1:
+            return None
+        if _processor is None:
+            _processor = ChapterProcessor(settings['processes'])
+            _processor.start()
+        return _processor
@@ -0,0 +1,472 @@
+import re
+import sys
+import time
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import metrics
+from chapter_index import ChapterIndex
+from http_client import fetch
+from parsers import ScopeWatcher, make_soup, parse_scoped
+from sites import GENERIC_ADAPTER, get_adapter
+
+# Download tuning defaults
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_REQUESTS_PER_SECOND = 2.0
+DEFAULT_BURST = 3
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: allows `rate` requests per second on average,
+    with short bursts of up to `capacity` requests.
+    Callers may pass a rate of their own (see acquire): while any of them
+    is waiting, the bucket refills at the lowest rate currently asked for.
+    """
+    def __init__(self, rate, capacity):
+        self.lock = threading.Lock()
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.waiting = Counter()  # rate -> callers waiting for a token at that rate
+        self.configure(rate, capacity)
+
+    def configure(self, rate, capacity):
+        with self.lock:
+            self.rate = max(float(rate), 0.01)
+            self.capacity = max(float(capacity), 1.0)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def _refill(self, scale):
+        # Called with self.lock held, before the set of waiting callers changes,
+        # so every interval is credited at the rate that applied during it
+        now = time.monotonic()
+        rate = min(self.waiting, default=self.rate) * scale
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        return rate
+
+    def acquire(self, scale=1.0, rate=None):
+        # Block until a token is available; `scale` slows the refill down (see politeness.py)
+        requested = self.rate if rate is None else max(float(rate), 0.01)
+        with self.lock:
+            self._refill(scale)
+            self.waiting[requested] += 1
+        try:
+            while True:
+                with self.lock:
+                    rate = self._refill(scale)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / rate
+                time.sleep(wait)
+        finally:
+            with self.lock:
+                self._refill(scale)
+                self.waiting[requested] -= 1
+                if not self.waiting[requested]:
+                    del self.waiting[requested]
+
+class RateLimit:
+    """
+    A caller's share of a host's TokenBucket, at `rate` requests per second at most.
+    """
+    def __init__(self, bucket, rate):
+        self.bucket = bucket
+        self.rate = rate
+
+    def acquire(self, scale=1.0):
+        self.bucket.acquire(scale, self.rate)
+
+_host_limiters = {}
+_host_limiters_lock = threading.Lock()
+
+def get_rate_limiter(url, rate=DEFAULT_REQUESTS_PER_SECOND, burst=DEFAULT_BURST):
+    """
+    Returns a rate limiter for the host of `url`, allowing at most `rate` requests per second.
+    All threads talking to the same host draw from the same bucket; when exports asking
+    for different rates run at the same time, the host gets the lowest of them.
+    """
+    host = urlparse(url).netloc.lower()
+    with _host_limiters_lock:
+        bucket = _host_limiters.get(host)
+        if bucket is None:
+            # Callers pass their own rate: the bucket's is only used by acquire() without one
+            bucket = TokenBucket(rate, burst)
+            _host_limiters[host] = bucket
+    return RateLimit(bucket, rate)
+
+def get_chapters(url, status_callback=None, max_workers=DEFAULT_MAX_WORKERS, requests_per_second=DEFAULT_REQUESTS_PER_SECOND, index_cache=None, refresh=False):
+    """
+    Fetches the URL and extracts chapter links from all pages if pagination exists.
+    Site-specific lookups are done by the adapter registered for the URL's host (see sites.py).
+    With an IndexCache, a recent analysis of the same novel is returned without any request
+    (unless `refresh`). An older one is refreshed incrementally: only the first index page
+    and the pages from the previously last one on are fetched, the chapters of the pages
+    in between are taken from the cache.
+    Returns (chapters, title, cover_url, author), chapters being a ChapterIndex;
+    raises if the index page itself can't be fetched.
+    """
+    cached = index_cache.get(url) if index_cache else None
+    if cached and not refresh and index_cache.is_fresh(cached):
+        return cached['chapters'], cached['title'], cached['cover_url'], cached['author']
+
+    adapter = get_adapter(url)
+    novel_author = "Unknown"
+    
+    # 1. Fetch First Page
+    if status_callback:
+        status_callback("Analyzing page 1")
+        
+    response = fetch(url, rate_limiter=get_rate_limiter(url, requests_per_second))
+    response.raise_for_status()
+    soup = make_soup(response.content)
+
+    novel_title = adapter.novel_title(soup, url)
+
+    # Extract Author
+    try:
+        novel_author = adapter.novel_author(soup) or novel_author
+    except Exception as e:
+        print(f"Error extraction author: {e}", file=sys.stderr)
+
+    # Extract Cover Image
+    cover_url = ""
+    try:
+        cover_url = adapter.cover_url(soup, url)
+    except Exception as e:
+        print(f"Error extracting cover: {e}", file=sys.stderr)
+
+    # 2. Extract from first page
+    page_results = {1: adapter.chapter_links(soup, url)}
+    
+    # 3. Pagination Logic
+    last_page = adapter.last_page(soup)
+
+    # Incremental refresh: pages before the previously last one haven't changed
+    incremental = (cached is not None and 1 < cached['last_page'] <= last_page
+                   and not index_cache.needs_full_crawl(cached))
+    first_page = cached['last_page'] if incremental else 1
+    all_chapters = ChapterIndex(cached['chapters'][:cached['stable_count']] if incremental else ())
+    pages = range(max(2, first_page), last_page + 1)
+    failed_pages = 0
+    
+    if pages:
+        if status_callback:
+            status_callback(f"Found {last_page} pages. Starting deep analysis...")
+
+        def fetch_page(p):
+            page_url = adapter.page_url(url, p)
+            # Be polite: all workers share the host's token bucket
+            resp = fetch(page_url, rate_limiter=get_rate_limiter(page_url, requests_per_second))
+            resp.raise_for_status()
+            # Only the chapter list is needed from the following pages
+            page_soup = (adapter.index_scope and parse_scoped(resp.content, adapter.index_scope)) or make_soup(resp.content)
+            return adapter.chapter_links(page_soup, page_url)
+
+        # Every page URL is known up front, so fetch them concurrently
+        # and merge the results back in page order afterwards.
+        with ThreadPoolExecutor(max_workers=max(1, int(max_workers))) as executor:
+            futures = {executor.submit(fetch_page, p): p for p in pages}
+            for done, future in enumerate(as_completed(futures), start=1):
+                p = futures[future]
+                if status_callback:
+                    status_callback(f"Analyzing page {pages.start + done - 1}/{last_page}")
+                try:
+                    page_results[p] = future.result()
+                except Exception as e:
+                    print(f"Error on page {p}: {e}", file=sys.stderr)
+                    failed_pages += 1
+                    # Continue with the other pages
+
+    # Merge in page order; the index skips URLs it already lists
+    stable_count = len(all_chapters)
+    for p in range(first_page, last_page + 1):
+        if p == last_page:
+            stable_count = len(all_chapters)
+        all_chapters.extend(page_results.get(p, []))
+
+    # A list with holes would be served to everyone until it expires
+    if index_cache and all_chapters and not failed_pages:
+        index_cache.put(url, all_chapters, novel_title, novel_author, cover_url, last_page, stable_count,
+                        full_crawl=not incremental)
+
+    return all_chapters, novel_title, cover_url, novel_author
+
+# Chapter extraction
+# Elements considered when stripping the chapter title from the top of the text
+HEADER_TAGS = frozenset(['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'div'])
+# Inner divs with these classes are navigation or ads
+NAV_CLASSES = frozenset(['nav', 'navigation', 'ads'])
+CHAPTER_HEADING_RE = re.compile(r'^chapter\s+\d+')
+MAX_HEADER_LINES = 5
+
+def is_header_text(text, title):
+    """
+    Tells whether a leading line of the chapter is its title (or empty), `title` being lowercased.
+    """
+    text = text.lower().strip()
+    if not text: return True # Treat empty as "header to remove" to get to next
+
+    # Check 1: Exact or fuzzy title match
+    if title in text or (len(text) > 5 and text in title):
+        return True
+
+    # Check 2: "Chapter N" pattern
+    # Matches: "Chapter 1", "Chapter 1: Title", "Chapter 1 - Title"
+    return bool(CHAPTER_HEADING_RE.match(text))
+
+def clean_content(content_div, chapter_title=None):
+    """
+    Strips scripts, styles, nav/ad divs, prev/next chapter lines and the leading
+    title lines from the container, in one depth-first walk. Removed elements
+    are not descended into, so every node is visited at most once.
+    """
+    from bs4 import Tag
+    title = (chapter_title or '').lower().strip()
+    header_lines = MAX_HEADER_LINES  # Title lines are only looked for until real content starts
+    stack = list(reversed(content_div.contents))
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, Tag):
+            continue
+        name = node.name
+        if name in ('script', 'style') or (name == 'div' and NAV_CLASSES.intersection(node.get('class') or ())):
+            node.decompose()
+            continue
+
+        if name == 'p':
+            # Remove purely navigation text/links usually at bottom
+            text = node.get_text().lower()
+            if 'prev chapter' in text or 'next chapter' in text:
+                node.decompose()
+                continue
+
+        if header_lines and name in HEADER_TAGS:
+            if is_header_text(node.get_text(strip=True), title):
+                node.decompose()
+                header_lines -= 1
+                continue
+            header_lines = 0
+
+        stack.extend(reversed(node.contents))
+
+def clean_chapter_page(html, chapter_title=None, adapter=None):
+    """
+    Extracts and cleans the chapter text from a chapter page.
+    The container is looked up by `adapter` (the generic heuristics by default).
+    Returns (content, {stage: seconds}) for the parse, locate, clean and serialize
+    stages; content is None if no content container could be found.
+    Records nothing itself, so it can run in a worker process (see postprocess.py).
+    """
+    adapter = adapter or GENERIC_ADAPTER
+    started = time.perf_counter()
+    # Fast path: only build a tree for the site's content container
+    soup = parse_scoped(html, adapter.content_scope) if adapter.content_scope else None
+    if soup is None:
+        soup = make_soup(html)
+    parsed = time.perf_counter()
+
+    content_div = adapter.find_content(soup)
+    located = time.perf_counter()
+
+    content = None
+    if content_div:
+        clean_content(content_div, chapter_title)
+        cleaned = time.perf_counter()
+        content = str(content_div)
+    else:
+        cleaned = located
+    finished = time.perf_counter()
+
+    return content, {'parse': parsed - started, 'locate': located - parsed,
+                     'clean': cleaned - located, 'serialize': finished - cleaned}
+
+def record_stages(timings):
+    # Adds timings returned by clean_chapter_page to the stage_seconds metrics
+    for stage, seconds in timings.items():
+        metrics.observe('stage_seconds', seconds, stage=stage)
+
+def clean_chapter_html(html, chapter_title=None, adapter=None):
+    """
+    Like clean_chapter_page, but returns only the content (or None) and records
+    the time spent in each stage as stage_seconds metrics.
+    """
+    content, timings = clean_chapter_page(html, chapter_title, adapter)
+    record_stages(timings)
+    return content
+
+# Rounds a failing chapter gets before the export gives up (each one already retries transient HTTP errors)
+CHAPTER_ATTEMPTS = 3
+REQUEUE_DELAY = 5.0  # Seconds before a requeued chapter is tried again, times its attempt number
+
+class ChapterDownloadError(Exception):
+    """
+    A chapter could not be downloaded, even after being requeued.
+    """
+
+class ChapterMissingError(ChapterDownloadError):
+    """
+    The chapter page doesn't exist (a 4xx other than 408/429) or holds no chapter text:
+    trying again won't help.
+    """
+
+# Client errors that are worth retrying: the page may well be there next time
+RETRYABLE_CLIENT_STATUSES = {408, 429}
+
+def fetch_chapter_content(url, chapter_title=None, cache=None, rate_limiter=None, processor=None):
+    """
+    Downloads and cleans chapter content.
+    With a ChapterProcessor (see postprocess.py), the page is parsed and cleaned
+    in one of its worker processes instead of the calling thread.
+    The page is streamed in and the download stops once the adapter's content
+    container has been closed, or at the HTTP client's max body size.
+    If a ChapterCache is given, fresh entries are served without any request
+    and stale ones are revalidated with ETag/Last-Modified.
+    The optional rate limiter is only consulted when we actually hit the network.
+    Raises ChapterMissingError if the page doesn't exist (4xx other than 408/429),
+    other exceptions on network/HTTP errors; returns None if no content container was found.
+    """
+    headers = {}
+    
+    cached = cache.get(url) if cache else None
+    if cached:
+        if cache.is_fresh(cached):
+            metrics.count('chapters_total', source='cache')
+            return cached['cleaned_html']
+        headers.update(cache.validation_headers(cached))
+
+    # Stop reading the page as soon as the chapter text is complete
+    adapter = get_adapter(url)
+    scope = adapter.content_scope
+    make_stop = (lambda: ScopeWatcher(scope).feed) if scope else None
+    response = fetch(url, headers=headers, rate_limiter=rate_limiter, make_stop=make_stop)
+    if cached and response.status_code == 304:
+        cache.touch(url)
+        metrics.count('chapters_total', source='revalidated')
+        return cached['cleaned_html']
+    if 400 <= response.status_code < 500 and response.status_code not in RETRYABLE_CLIENT_STATUSES:
+        raise ChapterMissingError(f"{url} returned HTTP {response.status_code}")
+    response.raise_for_status()
+    metrics.count('chapters_total', source='network')
+    if response.truncated:
+        print(f"Page {url} is over {len(response.content)} bytes, only its beginning is used", file=sys.stderr)
+
+    if processor is not None:
+        content = processor.clean(response.content, chapter_title, adapter)
+    else:
+        content = clean_chapter_html(response.content, chapter_title, adapter)
+    if content is not None and cache:
+        cache.put(url, response.content, content,
+                  etag=response.headers.get('ETag'),
+                  last_modified=response.headers.get('Last-Modified'))
+    return content
+
+def download_chapters(chapters_data, max_workers=DEFAULT_MAX_WORKERS, requests_per_second=DEFAULT_REQUESTS_PER_SECOND, progress_callback=None, cache=None, journal=None, processor=None, skip_missing=True):
+    """
+    Downloads the given chapters concurrently and yields their contents one by one, in the original order.
+    Requests are spread over `max_workers` threads and throttled per host by a token bucket
+    (slowed down further by the host's controller when the site struggles, see politeness.py).
+    Only a small window of chapters ahead of the one being consumed is in flight or buffered,
+    so memory stays bounded however many chapters there are.
+    A chapter that fails is put back in the queue, behind the ones already waiting, up to
+    CHAPTER_ATTEMPTS times; after that ChapterDownloadError is raised rather than an error
+    message ending up in the book, and the chapters still queued are dropped.
+    A missing chapter (a dead link or a page without chapter text, see ChapterMissingError)
+    is not retried: with `skip_missing` it is yielded as None, with a warning, otherwise
+    the error is raised right away.
+    With a JobJournal, every chapter is checkpointed as soon as it has been downloaded,
+    and chapters the journal already holds are read back instead of downloaded again,
+    so a failed export picks up where it stopped when it is started again.
+    Downloaded pages are cleaned by `processor`, if given (see fetch_chapter_content).
+    """
+    total = len(chapters_data)
+    if not total:
+        return
+    max_workers = max(1, int(max_workers))
+    window = max_workers * 4
+
+    stopping = threading.Event()  # Set when the download is abandoned
+
+    def worker(index, chapter_info, attempt):
+        if attempt and stopping.wait(REQUEUE_DELAY * attempt):
+            return None
+        limiter = get_rate_limiter(chapter_info['URL'], requests_per_second)
+        metrics.add_gauge('downloads_in_flight', 1)
+        try:
+            content = fetch_chapter_content(chapter_info['URL'], chapter_info['Title'], cache=cache, rate_limiter=limiter,
+                                            processor=processor)
+            if content is None:
+                raise ChapterMissingError(f"No chapter text found on {chapter_info['URL']}")
+        except ChapterMissingError as e:
+            metrics.count('chapter_failures_total', reason='missing')
+            if not skip_missing:
+                raise
+            print(f"Skipping {chapter_info['Title']}: {e}", file=sys.stderr)
+            metrics.count('chapters_skipped_total')
+            return None
+        except Exception as e:
+            print(f"Error downloading {chapter_info['URL']} (attempt {attempt + 1}/{CHAPTER_ATTEMPTS}): {e}", file=sys.stderr)
+            metrics.count('chapter_failures_total', reason='error')
+            raise
+        finally:
+            metrics.add_gauge('downloads_in_flight', -1)
+        if journal is not None:
+            journal.record(index, chapter_info['URL'], content)
+        return content
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}  # index -> (future, attempt)
+        failed = queue.SimpleQueue()  # (index, future) of the attempts that raised
+
+        def submit(index, attempt):
+            def on_done(future):
+                if not future.cancelled() and future.exception() is not None:
+                    failed.put((index, future))
+            future = executor.submit(worker, index, chapters_data[index], attempt)
+            future.add_done_callback(on_done)
+            pending[index] = (future, attempt)
+
+        def requeue(index):
+            future, attempt = pending[index]
+            error = future.exception()
+            if isinstance(error, ChapterMissingError):
+                raise ChapterMissingError(f"Missing chapter {chapters_data[index]['Title']}: {error}") from error
+            if attempt + 1 >= CHAPTER_ATTEMPTS:
+                raise ChapterDownloadError(f"Could not download {chapters_data[index]['Title']} "
+                                           f"({chapters_data[index]['URL']}) after {CHAPTER_ATTEMPTS} attempts: {error}") from error
+            metrics.count('chapters_requeued_total')
+            submit(index, attempt + 1)
+
+        try:
+            next_to_submit = 0
+            for i in range(total):
+                while next_to_submit < total and next_to_submit < i + window:
+                    chapter_info = chapters_data[next_to_submit]
+                    if not (journal is not None and journal.is_done(next_to_submit, chapter_info['URL'])):
+                        submit(next_to_submit, 0)
+                    next_to_submit += 1
+                # Failed chapters go back in the queue as soon as they fail, not when their turn comes
+                while not failed.empty():
+                    index, future = failed.get()
+                    if index in pending and pending[index][0] is future:
+                        requeue(index)
+                if i in pending:
+                    while pending[i][0].exception() is not None:
+                        requeue(i)
+                    content = pending.pop(i)[0].result()
+                else:
+                    content = journal.read(i)
+                    metrics.count('chapters_total', source='journal')
+                # Progress is reported from the calling thread (Streamlit elements can't be updated from workers)
+                if progress_callback:
+                    progress_callback(i + 1, total, chapters_data[i]['Title'])
+                yield content
+        except BaseException:
+            # Failed or abandoned: drop the queued chapters and wake up the ones waiting to be
+            # retried, instead of letting the whole window run to the end first
+            stopping.set()
+            executor.shutdown(cancel_futures=True)
+            raise
@@ -0,0 +1,267 @@
+import re
+import sys
+from urllib.parse import urlparse, urljoin, parse_qs, urlencode, urlunparse
+
+class Selector:
+    """
+    A CSS selector compiled with soupsieve the first time it is used,
+    so importing the adapters doesn't load the selector engine.
+    """
+
+    def __init__(self, css):
+        self.css = css
+        self.compiled = None
+
+    def _compile(self):
+        if self.compiled is None:
+            import soupsieve
+            self.compiled = soupsieve.compile(self.css)
+        return self.compiled
+
+    def select(self, soup):
+        return self._compile().select(soup)
+
+    def select_one(self, soup):
+        return self._compile().select_one(soup)
+
+class GenericAdapter:
+    """
+    Knows how to read a novel site: where the chapter list, pagination, author,
+    cover and chapter text are, and how the index pages are numbered.
+    This one works by trial and error on layouts it has never seen; site adapters
+    subclass it, declare precompiled selectors for their layout and fall back to
+    the generic heuristics only when a lookup misses.
+    """
+    name = 'generic'
+    hosts = ()
+    # Ids handed to parse_scoped, so only the relevant part of a page gets a tree
+    index_scope = 'list-chapter'
+    content_scope = 'chapter-content'
+
+    def novel_title(self, soup, url):
+        # Try to extract title from URL first for a cleaner name
+        novel_title = "Web Novel"
+        try:
+            path = urlparse(url).path
+            filename = path.split('/')[-1] # e.g., a-will-eternal.html
+            slug = filename.rsplit('.', 1)[0] # a-will-eternal
+
+            if slug and slug != "index":
+                clean_title = slug.replace('-', ' ').title()
+                if len(clean_title) > 3:
+                    novel_title = clean_title
+        except Exception as e:
+            print(f"Error parsing URL for title: {e}", file=sys.stderr)
+
+        if novel_title == "Web Novel" and soup.title:
+             novel_title = soup.title.get_text(strip=True).split('|')[0].strip()
+        return novel_title
+
+    def novel_author(self, soup):
+        # Method 1: Search by string text 'Author:' or 'Writer:'
+        # This returns the NavigableString "Author:" even if inside an <h3>
+        author_labels = soup.find_all(string=re.compile(r'(Author|Writer)\s*:', re.IGNORECASE))
+
+        for label in author_labels:
+            parent = label.parent
+            # Case A: The name is in the same element (e.g. <li>Author: Name</li>)
+            full_text = parent.get_text(strip=True)
+            cleaned = re.sub(r'^(Author|Writer)\s*:\s*', '', full_text, flags=re.IGNORECASE).strip()
+
+            if cleaned and len(cleaned) > 1:
+                return cleaned
+
+            # Case B: The name is in the next sibling (e.g. <h3>Author:</h3> <a...>Name</a>)
+            # Traverse siblings until we find text
+            next_node = parent.next_sibling
+            while next_node:
+                if isinstance(next_node, str):
+                    text = next_node.strip()
+                elif hasattr(next_node, 'get_text'):
+                    # It's a tag
+                    text = next_node.get_text(strip=True)
+                else:
+                    text = ''
+                if text:
+                    return text
+                next_node = next_node.next_sibling
+        return None
+
+    def cover_url(self, soup, url):
+        # Search for typical cover containers
+        cover_div = soup.find('div', class_=lambda c: c and any(x in c for x in ['book', 'book-img', 'image', 'thumb']))
+        if cover_div:
+            img_tag = cover_div.find('img')
+            if img_tag and img_tag.get('src'):
+                # Handle relative URLs
+                return urljoin(url, img_tag.get('src'))
+        return ""
+
+    def chapter_links(self, soup, base_url):
+        chapters = []
+        # Refined search: priority to specific ID 'list-chapter'
+        main_list = soup.find(id='list-chapter')
+        if main_list:
+            links = main_list.find_all('a')
+            for link in links:
+                title = link.get_text(strip=True)
+                href = link.get('href')
+                if href and title:
+                    # Filter out pagination links
+                    if title.isdigit() or title in ['Next', 'Prev', 'First', 'Last', 'Select page', '<', '>'] or any(x in title for x in ['<<', '>>', '»', '«']):
+                        continue
+                    if not href.startswith('javascript'):
+                        chapters.append({'Title': title, 'URL': urljoin(base_url, href)})
+        else:
+             # Fallback
+            potential_containers = soup.find_all(['ul', 'div'], class_=lambda c: c and any(x in c for x in ['list-chapter', 'chapter-list', 'chapters']))
+            for container in potential_containers:
+                links = container.find_all('a')
+                for link in links:
+                    title = link.get_text(strip=True)
+                    href = link.get('href')
+                    if href and title and not href.startswith('javascript'):
+                        chapters.append({'Title': title, 'URL': urljoin(base_url, href)})
+        return chapters
+
+    def last_page(self, soup):
+        last_page = 1
+        pagination = soup.find('ul', class_='pagination') or soup.find(class_='pagination')
+        if pagination:
+            # Find all page numbers
+            for link in pagination.find_all('a'):
+                text = link.get_text(strip=True)
+                # Check for "Last": the page number is in its href (e.g. ?page=20)
+                if 'Last' in text:
+                    num = page_number(link.get('href'))
+                elif text.isdigit():
+                    num = int(text)
+                else:
+                    continue
+                if num > last_page:
+                    last_page = num
+        return last_page
+
+    def page_url(self, url, page):
+        # NovelFull standard: ?page=X, appended to the given URL (or replacing the one it has)
+        parsed_url = urlparse(url)
+        query = parse_qs(parsed_url.query)
+        query['page'] = [str(page)]
+        new_query = urlencode(query, doseq=True)
+        return urlunparse((parsed_url.scheme, parsed_url.netloc, parsed_url.path, parsed_url.params, new_query, parsed_url.fragment))
+
+    def find_content(self, soup):
+        """
+        Finds the chapter container without re-scanning the tree.
+        Known containers win, in order of preference:
+        id chapter-content, div.chapter-content, div.entry-content (Wordpress standard).
+        Otherwise the div with the most paragraphs is returned; paragraph counts are
+        summed bottom-up in one reverse walk, instead of a find_all('p') per div.
+        """
+        tags = soup.find_all(True)
+        by_class = {}
+        for tag in tags:
+            if tag.get('id') == 'chapter-content':
+                return tag
+            if tag.name == 'div':
+                classes = tag.get('class') or ()
+                for cls in ('chapter-content', 'entry-content'):
+                    if cls in classes and cls not in by_class:
+                        by_class[cls] = tag
+        for cls in ('chapter-content', 'entry-content'):
+            if cls in by_class:
+                return by_class[cls]
+
+        # Fallback: find the div with the most p tags
+        # Children come after their parent in document order, so walking backwards sees them first
+        paragraphs = {}
+        for tag in reversed(tags):
+            count = paragraphs.get(id(tag), 0) + (tag.name == 'p')
+            if tag.parent is not None:
+                paragraphs[id(tag.parent)] = paragraphs.get(id(tag.parent), 0) + count
+            paragraphs[id(tag)] = count
+        divs = [tag for tag in tags if tag.name == 'div']
+        return max(divs, key=lambda d: paragraphs[id(d)]) if divs else None
+
+class NovelFullAdapter(GenericAdapter):
+    """
+    novelfull.com and its mirrors: chapter list in #list-chapter, 50 chapters per
+    index page numbered with ?page=N, chapter text in #chapter-content.
+    """
+    name = 'novelfull'
+    hosts = ('novelfull.com', 'novelfull.net', 'novelfull.me')
+
+    CHAPTER_LINKS = Selector('#list-chapter ul.list-chapter a[href]')
+    LAST_PAGE_LINK = Selector('ul.pagination li.last a[href]')
+    PAGE_LINKS = Selector('ul.pagination a[href]')
+    AUTHOR = Selector('.info a[href*="/author/"]')
+    COVER = Selector('.book img[src]')
+    CONTENT = Selector('#chapter-content')
+
+    def novel_author(self, soup):
+        link = self.AUTHOR.select_one(soup)
+        if link and link.get_text(strip=True):
+            return link.get_text(strip=True)
+        return super().novel_author(soup)
+
+    def cover_url(self, soup, url):
+        img_tag = self.COVER.select_one(soup)
+        if img_tag:
+            return urljoin(url, img_tag['src'])
+        return super().cover_url(soup, url)
+
+    def chapter_links(self, soup, base_url):
+        # The list holds chapter links only, pagination sits outside it
+        chapters = []
+        for link in self.CHAPTER_LINKS.select(soup):
+            title = link.get_text(strip=True)
+            href = link['href']
+            if title and not href.startswith('javascript'):
+                chapters.append({'Title': title, 'URL': urljoin(base_url, href)})
+        return chapters or super().chapter_links(soup, base_url)
+
+    def last_page(self, soup):
+        link = self.LAST_PAGE_LINK.select_one(soup)
+        if link:
+            return max(1, page_number(link['href']))
+        # Few pages: no "Last" link, the numbered links are all there
+        numbers = [int(a.get_text(strip=True)) for a in self.PAGE_LINKS.select(soup) if a.get_text(strip=True).isdigit()]
+        return max(numbers, default=1)
+
+    def find_content(self, soup):
+        return self.CONTENT.select_one(soup) or super().find_content(soup)
+
+def page_number(url_str):
+    """
+    Returns the ?page= number of a pagination link, or 0.
+    """
+    if not url_str: return 0
+    qs = parse_qs(urlparse(url_str).query)
+    if 'page' in qs and qs['page'][0].isdigit():
+        return int(qs['page'][0])
+    return 0
+
+GENERIC_ADAPTER = GenericAdapter()
+_adapters = {}
+
+def register_adapter(adapter, hosts=None):
+    """
+    Makes `adapter` handle the given hosts (default: adapter.hosts) and their subdomains.
+    """
+    for host in hosts or adapter.hosts:
+        _adapters[host.lower()] = adapter
+
+def get_adapter(url):
+    """
+    Returns the adapter registered for the host of `url`, or the generic one.
+    www.example.com and m.example.com are matched by an adapter for example.com.
+    """
+    host = (urlparse(url).hostname or '').lower()
+    while host:
+        adapter = _adapters.get(host)
+        if adapter is not None:
+            return adapter
+        host = host.partition('.')[2]
+    return GENERIC_ADAPTER
+
+register_adapter(NovelFullAdapter())